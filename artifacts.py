@@ -0,0 +1,40 @@
+import llmcache
+import sqlite3
+import threading
+import time
+
+
+class ArtifactStore:
+    # Precomputed chapter summaries and quizzes; each row records the model + prompt key it was generated from
+    def __init__(self, path='artifacts.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS artifacts (kind TEXT, version TEXT, book TEXT, chapter TEXT, model TEXT, prompt_key TEXT, response TEXT, created REAL, PRIMARY KEY (kind, version, book, chapter))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS artifacts_prompt_key ON artifacts (prompt_key)')
+        self.connection.commit()
+
+    def get(self, model, prompt):
+        # Content-addressed lookup, so any request that builds the same prompt is served the stored result
+        with self.lock:
+            row = self.connection.execute('SELECT response FROM artifacts WHERE prompt_key = ?', (llmcache.CompletionCache.key(model, prompt),)).fetchone()
+        return row[0] if row is not None else None
+
+    def is_current(self, kind, version, book, chapter, model, prompt):
+        with self.lock:
+            row = self.connection.execute('SELECT prompt_key FROM artifacts WHERE kind = ? AND version = ? AND book = ? AND chapter = ?', (kind, version, book, chapter)).fetchone()
+        return row is not None and row[0] == llmcache.CompletionCache.key(model, prompt)
+
+    def put(self, kind, version, book, chapter, model, prompt, response):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO artifacts (kind, version, book, chapter, model, prompt_key, response, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (kind, version, book, chapter, model, llmcache.CompletionCache.key(model, prompt), response, time.time()))
+            self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            return {kind: count for kind, count in self.connection.execute('SELECT kind, COUNT(*) FROM artifacts GROUP BY kind')}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+import dictionary
+
+
+def measure(name, load, lookup, words):
+    tracemalloc.start()
+    start = time.perf_counter()
+    load()
+    load_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    latencies = []
+    for word in words:
+        start = time.perf_counter()
+        lookup(word)
+        latencies.append(time.perf_counter() - start)
+    return {
+        'backend': name,
+        'load_ms': load_time * 1000,
+        'memory_mb': memory / (1024 * 1024),
+        'lookup_mean_us': statistics.mean(latencies) * 1e6,
+        'lookup_p95_us': sorted(latencies)[int(len(latencies) * 0.95)] * 1e6,
+    }
+
+
+def wordnet_lookup(word):
+    synset = dictionary.wordnet_synset(word)
+    return dictionary.synset_info(synset) if synset is not None else None
+
+
+def load_wordnet():
+    # The corpus is lazy; the first real query is what pulls it into memory
+    dictionary.wordnet_synset('beginning')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the prebuilt dictionary table with live WordNet lookups.')
+    parser.add_argument('--path', default=dictionary.dictionary_path)
+    parser.add_argument('--words', type=int, default=2000)
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    with open(args.path, 'r') as f:
+        forms = list(json.load(f)['forms'])
+    words = random.Random(0).sample(forms, min(args.words, len(forms)))
+
+    results = [
+        measure('table', lambda: dictionary.load(args.path), dictionary.get_word_info, words),
+        measure('wordnet', load_wordnet, wordnet_lookup, words),
+    ]
+    for result in results:
+        print(f'{result["backend"]:<8} load {result["load_ms"]:9.1f}ms  memory {result["memory_mb"]:7.1f}MB  lookup mean {result["lookup_mean_us"]:8.1f}us  p95 {result["lookup_p95_us"]:8.1f}us')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
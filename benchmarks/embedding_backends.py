@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+backends = ['torch', 'onnx', 'onnx-int8']
+
+
+def load_corpus(path, limit):
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        bible_json = json.load(file)
+    texts = [bible_json[book][chapter][verse] for book in bible_json for chapter in bible_json[book] for verse in bible_json[book][chapter]]
+    if limit:
+        # Spread the sample across the whole Bible rather than only Genesis
+        step = max(1, len(texts) // limit)
+        texts = texts[::step][:limit]
+    return texts
+
+
+def make_queries(texts, count):
+    # Short phrases cut from verses, similar to what readers highlight
+    step = max(1, len(texts) // count)
+    return [' '.join(text.split()[:6]) for text in texts[::step][:count]]
+
+
+def run_worker(backend, corpus, limit, queries, batch_size, output_dir):
+    # Runs in its own process so peak RSS belongs to a single backend
+    import embedding
+    embedding.backend = backend
+
+    texts = load_corpus(corpus, limit)
+    query_texts = make_queries(texts, queries)
+
+    start = time.perf_counter()
+    embedding.load_model()
+    load_time = time.perf_counter() - start
+
+    latencies = []
+    query_vectors = []
+    for query in query_texts:
+        start = time.perf_counter()
+        query_vectors.append(np.asarray(embedding.get_embedding(query, mode='query'))[0])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    doc_vectors = [np.asarray(embedding.get_embedding(texts[i:i + batch_size], mode='sentence')) for i in range(0, len(texts), batch_size)]
+    elapsed = time.perf_counter() - start
+
+    np.save(os.path.join(output_dir, f'{backend}-queries.npy'), np.stack(query_vectors).astype(np.float32))
+    np.save(os.path.join(output_dir, f'{backend}-docs.npy'), np.concatenate(doc_vectors).astype(np.float32))
+    stats = {
+        'load_seconds': load_time,
+        'query_p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'query_p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'verses_per_second': len(texts) / elapsed,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    with open(os.path.join(output_dir, f'{backend}.json'), 'w') as f:
+        json.dump(stats, f)
+
+
+def top_k(queries, docs, k):
+    # L2 distance, matching the metric of the Milvus collection
+    distances = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ docs.T + (docs ** 2).sum(axis=1)[None, :]
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def compare(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for backend in args.backends:
+            print(f'Running {backend}...')
+            subprocess.run([sys.executable, '-m', 'benchmarks.embedding_backends', '--worker', backend, '--corpus', args.corpus, '--limit', str(args.limit), '--queries', str(args.queries), '--batch-size', str(args.batch_size), '--output-dir', output_dir], check=True)
+            with open(os.path.join(output_dir, f'{backend}.json'), 'r') as f:
+                results[backend] = json.load(f)
+
+        reference = args.backends[0]
+        reference_hits = top_k(np.load(os.path.join(output_dir, f'{reference}-queries.npy')), np.load(os.path.join(output_dir, f'{reference}-docs.npy')), 5)
+        for backend in args.backends:
+            hits = top_k(np.load(os.path.join(output_dir, f'{backend}-queries.npy')), np.load(os.path.join(output_dir, f'{backend}-docs.npy')), 5)
+            overlap = [len(set(a) & set(b)) / 5 for a, b in zip(reference_hits, hits)]
+            results[backend]['top5_agreement'] = float(np.mean(overlap))
+
+    print(f'{"backend":<10} {"load s":>8} {"p50 ms":>8} {"p95 ms":>8} {"verses/s":>10} {"peak MB":>9} {"top-5 agree":>12}')
+    for backend, stats in results.items():
+        print(f'{backend:<10} {stats["load_seconds"]:>8.2f} {stats["query_p50_ms"]:>8.2f} {stats["query_p95_ms"]:>8.2f} {stats["verses_per_second"]:>10.1f} {stats["peak_rss_mb"]:>9.1f} {stats["top5_agreement"]:>12.3f}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare latency, throughput, peak RSS and top-5 retrieval agreement of the embedding backends.')
+    parser.add_argument('--backends', nargs='+', default=backends, choices=backends, help='The first backend is the reference for top-5 agreement.')
+    parser.add_argument('--corpus', default='NASB1995_bible.json')
+    parser.add_argument('--limit', type=int, default=5000, help='Number of verses to embed; 0 embeds the whole corpus.')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--json', help='Also write the results to this file.')
+    parser.add_argument('--worker', choices=backends, help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.corpus, args.limit, args.queries, args.batch_size, args.output_dir)
+    else:
+        compare(args)
@@ -0,0 +1,166 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-in for the Ollama HTTP API: /api/generate with simulated model load, prefill and decode time
+settings = {
+    'load_ms': 0.0,
+    'prefill_ms_per_token': 0.5,
+    'decode_ms_per_token': 15.0,
+    'response_tokens': 64,
+    # Generations run at the same time per model, like OLLAMA_NUM_PARALLEL; later ones wait
+    'parallel': 2,
+}
+filler = ['the', 'Lord', 'spoke', 'to', 'his', 'people', 'and', 'they', 'listened', 'in', 'faith', 'with', 'great', 'joy']
+quiz = {
+    'Who spoke to the people?': {'options': {'A': 'The Lord', 'B': 'A king', 'C': 'A servant', 'D': 'No one'}, 'answer': 'A'},
+    'How did the people listen?': {'options': {'A': 'In fear', 'B': 'In faith', 'C': 'In anger', 'D': 'In silence'}, 'answer': 'B'},
+}
+
+loaded = set()
+slots = {}
+lock = threading.Lock()
+
+
+def count_tokens(text):
+    # Same estimate the app falls back to without a tokenizer
+    return len(text) // 4 + 1
+
+
+def model_slot(model):
+    with lock:
+        if model not in slots:
+            slots[model] = threading.Semaphore(settings['parallel'])
+        return slots[model]
+
+
+def response_tokens(prompt):
+    if 'Bible quiz' in prompt:
+        text = json.dumps(quiz)
+        # Roughly four characters per token, so the quiz takes as long to decode as its length suggests
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+    rng = random.Random(prompt)
+    return [(' ' if i else '') + rng.choice(filler) for i in range(settings['response_tokens'])]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/api/version':
+            self.send_json({'version': '0.0.0-fake'})
+        elif self.path == '/api/tags':
+            self.send_json({'models': [{'name': model, 'model': model} for model in sorted(loaded)]})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path != '/api/generate':
+            self.send_json({'error': 'not found'}, 404)
+            return
+        model = body.get('model', '')
+        prompt = body.get('prompt', '')
+        context = body.get('context') or []
+        stream = body.get('stream', True)
+
+        with model_slot(model):
+            started = time.perf_counter()
+            load = 0.0
+            with lock:
+                first = model not in loaded
+                loaded.add(model)
+            if first:
+                load = settings['load_ms'] / 1000
+                time.sleep(load)
+            if not prompt:
+                # An empty prompt only loads the model, like the app's warm-up call
+                self.send_json(self.final(model, '', context, 0, 0, load, 0.0, 0.0, started))
+                return
+
+            # A returned context means the earlier tokens are already in the KV cache; only the new prompt is prefilled
+            prompt_tokens = count_tokens(prompt)
+            prefill = prompt_tokens * settings['prefill_ms_per_token'] / 1000
+            time.sleep(prefill)
+            tokens = response_tokens(prompt)
+            decode_step = settings['decode_ms_per_token'] / 1000
+            if stream:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for token in tokens:
+                        time.sleep(decode_step)
+                        self.send_chunk({'model': model, 'created_at': now(), 'response': token, 'done': False})
+                    self.send_chunk(self.final(model, '', context, prompt_tokens, len(tokens), load, prefill, decode_step * len(tokens), started))
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # The app closed the stream, which aborts a real generation too
+                    self.close_connection = True
+            else:
+                time.sleep(decode_step * len(tokens))
+                self.send_json(self.final(model, ''.join(tokens), context, prompt_tokens, len(tokens), load, prefill, decode_step * len(tokens), started))
+
+    def send_chunk(self, body):
+        data = json.dumps(body).encode('utf-8') + b'\n'
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def final(self, model, text, context, prompt_tokens, eval_tokens, load, prefill, decode, started):
+        return {
+            'model': model,
+            'created_at': now(),
+            'response': text,
+            'done': True,
+            'done_reason': 'stop',
+            # Fake token ids; only the length matters to the app's session limits
+            'context': list(context) + list(range(prompt_tokens + eval_tokens)),
+            'total_duration': int((time.perf_counter() - started) * 1e9),
+            'load_duration': int(load * 1e9),
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': int(prefill * 1e9),
+            'eval_count': eval_tokens,
+            'eval_duration': int(decode * 1e9),
+        }
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def serve(host='127.0.0.1', port=11434):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f'Fake Ollama listening on http://{host}:{server.server_address[1]}', flush=True)
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake Ollama /api/generate with simulated prefill and decode latency.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--load-ms', type=float, default=settings['load_ms'], help='Delay of the first request to each model.')
+    parser.add_argument('--prefill-ms-per-token', type=float, default=settings['prefill_ms_per_token'])
+    parser.add_argument('--decode-ms-per-token', type=float, default=settings['decode_ms_per_token'])
+    parser.add_argument('--response-tokens', type=int, default=settings['response_tokens'])
+    parser.add_argument('--parallel', type=int, default=settings['parallel'])
+    args = parser.parse_args()
+
+    settings.update(load_ms=args.load_ms, prefill_ms_per_token=args.prefill_ms_per_token, decode_ms_per_token=args.decode_ms_per_token, response_tokens=args.response_tokens, parallel=args.parallel)
+    serve(args.host, args.port).serve_forever()
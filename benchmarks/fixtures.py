@@ -0,0 +1,71 @@
+import json
+import os
+import random
+
+import chapterstore
+
+# Small vocabulary so searches, definitions and repeated selections behave like they do on real text
+words = [
+    'God', 'Lord', 'light', 'darkness', 'water', 'earth', 'heaven', 'people', 'king', 'city', 'house', 'bread',
+    'wine', 'covenant', 'law', 'spirit', 'heart', 'faith', 'grace', 'mercy', 'peace', 'truth', 'word', 'life',
+    'death', 'servant', 'prophet', 'temple', 'altar', 'offering', 'shepherd', 'sheep', 'mountain', 'river',
+    'wilderness', 'Israel', 'Jerusalem', 'Moses', 'David', 'Abraham', 'sons', 'daughters', 'nations', 'enemies',
+    'glory', 'righteousness', 'wisdom', 'fear', 'love', 'blessed', 'holy', 'great', 'good', 'evil', 'and', 'the',
+    'of', 'to', 'in', 'he', 'they', 'said', 'went', 'came', 'spoke', 'gave', 'made', 'saw', 'called', 'built',
+]
+spoken = ['I', 'tell', 'you', 'follow', 'me', 'believe', 'and', 'live', 'my', 'Father', 'kingdom', 'come', 'truly']
+headings = ['The Beginning', 'A Covenant', 'The Journey', 'A Song of Praise', 'The Kingdom', 'Words of Wisdom']
+# Each version rewords a few words, like different translations of the same verse
+rewordings = {
+    'csb': {'said': 'declared'},
+    'esv': {},
+    'kjv': {'said': 'saith', 'you': 'thee', 'went': 'departed'},
+    'nasb': {},
+    'niv': {'wilderness': 'desert', 'offering': 'sacrifice'},
+    'nkjv': {'you': 'you all', 'said': 'answered'},
+}
+
+
+def verse_text(rng, version):
+    reword = rewordings.get(version, {})
+    text = [reword.get(word, word) for word in rng.choices(words, k=rng.randint(10, 24))]
+    if rng.random() < 0.2:
+        # Red-letter words, as marked in the real data
+        text += [f'{reword.get(word, word)}*r' for word in rng.choices(spoken, k=rng.randint(3, 8))]
+    text[0] = text[0].capitalize()
+    return ' '.join(text) + '.'
+
+
+def chapter_verses(book, chapter, version, verses_per_chapter):
+    # Seeded by location, so every version has the same verses apart from the rewording
+    rng = random.Random(f'{book}/{chapter}')
+    verses = [{'h': 2, 't': rng.choice(headings)}]
+    for verse in range(1, verses_per_chapter + 1):
+        verses.append({'r': f'{book} {chapter}:{verse}', 't': verse_text(rng, version)})
+    return verses
+
+
+def write_bible(directory, versions=chapterstore.version_selection, books=chapterstore.in_order, chapters_per_book=2, verses_per_chapter=8):
+    # Same layout as bible-data/data, so the app and the index builders read it unchanged
+    count = 0
+    for version in versions:
+        for book in books:
+            for chapter in range(1, chapters_per_book + 1):
+                path = chapterstore.chapter_path(version, book, chapter, directory)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    json.dump(chapter_verses(book, chapter, version, verses_per_chapter), f)
+                count += 1
+    print(f'Wrote {count} fixture chapters to {directory}')
+    return count
+
+
+def sample_verses(books=chapterstore.in_order, chapters_per_book=2, verses_per_chapter=8, version='nasb'):
+    # (book, chapter, verse, plain text) of every fixture verse, for building request payloads
+    verses = []
+    for book in books:
+        for chapter in range(1, chapters_per_book + 1):
+            for verse in chapter_verses(book, chapter, version, verses_per_chapter)[1:]:
+                number = verse['r'].split(':')[-1]
+                verses.append((book, str(chapter), number, chapterstore.plain_text(verse['t'])))
+    return verses
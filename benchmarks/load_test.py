@@ -0,0 +1,354 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+import chapterstore
+from benchmarks import fixtures
+from benchmarks.microbench import percentiles, print_results
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Share of requests per route; pages dominate, like readers who mostly read
+mix = {
+    'page': 40,
+    'explain_selection': 12,
+    'define_selection': 10,
+    'ask_question': 10,
+    'ask_selection': 10,
+    'get_quiz': 6,
+    'summarize_chapter': 12,
+}
+paths = {
+    'explain_selection': '/explain-selection',
+    'define_selection': '/define-selection',
+    'ask_question': '/ask_question',
+    'ask_selection': '/ask-selection',
+    'get_quiz': '/get_quiz',
+    'summarize_chapter': '/summarize_chapter',
+}
+# Routes that also have a Server-Sent Events variant at <path>/stream
+streamable = {'explain_selection', 'define_selection', 'ask_question', 'ask_selection', 'summarize_chapter'}
+questions = ['What does this chapter teach about {}?', 'Why is {} important here?', 'Who is speaking about {}?', 'How should I understand {}?']
+
+
+def parse_mix(text):
+    weights = dict(mix)
+    if text:
+        weights = {}
+        for part in text.split(','):
+            route, _, weight = part.partition('=')
+            if route not in mix:
+                raise ValueError(f'Unknown route {route!r}; choose from {", ".join(mix)}')
+            weights[route] = float(weight)
+    return {route: weight for route, weight in weights.items() if weight > 0}
+
+
+def build_request(route, rng, verses, session_id, stream):
+    book, chapter, verse, text = rng.choice(verses)
+    version = rng.choice(chapterstore.version_selection)
+    if route == 'page':
+        return 'GET', urllib.parse.quote(f'/{book}-{chapter}-{version}'), None
+    words = text.rstrip('.').split()
+    start = rng.randrange(max(1, len(words) - 4))
+    selection = ' '.join(words[start:start + rng.randint(2, 5)])
+    body = {'book': book, 'chapter': chapter, 'version': version}
+    if route in ('explain_selection', 'ask_question', 'ask_selection'):
+        # Every simulated reader keeps one session, as a browser tab does
+        body['session_id'] = session_id
+    if route in ('explain_selection', 'ask_selection'):
+        body.update(selected_text=selection, full_context=f'{verse}) {text}')
+    if route == 'define_selection':
+        body.update(selected_text=rng.choice(words), full_context=f'{verse}) {text}')
+    if route in ('ask_question', 'ask_selection'):
+        body.update(user_query=rng.choice(questions).format(rng.choice(words)))
+    path = paths[route]
+    if stream and route in streamable:
+        path += '/stream'
+    return 'POST', path, body
+
+
+def send(connection, method, path, body):
+    # Returns (status, seconds to the first body line, seconds to the end); the first line of a stream is its first token
+    headers = {'Accept-Encoding': 'gzip'}
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    start = time.perf_counter()
+    connection.request(method, path, body=data, headers=headers)
+    response = connection.getresponse()
+    first = None
+    content = []
+    while True:
+        line = response.readline()
+        if first is None:
+            first = time.perf_counter()
+        if not line:
+            break
+        content.append(line)
+    end = time.perf_counter()
+    # readline() leaves the response open at the end of the body, and the next request on this connection would fail
+    response.close()
+    status = response.status
+    if response.getheader('Content-Type', '').startswith('text/event-stream') and any(line.startswith(b'event: error') for line in content):
+        status = 'stream error'
+    return status, first - start, end - start
+
+
+def client_loop(index, args, address, verses, weights, warmup_end, deadline, samples):
+    rng = random.Random(args.seed * 1000 + index)
+    session_id = uuid.UUID(int=rng.getrandbits(128)).hex
+    routes = list(weights)
+    route_weights = [weights[route] for route in routes]
+    connection = None
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, route_weights)[0]
+        method, path, body = build_request(route, rng, verses, session_id, args.stream)
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(*address, timeout=args.timeout)
+            status, first, total = send(connection, method, path, body)
+        except (OSError, http.client.HTTPException) as e:
+            status, first, total = type(e).__name__, None, time.perf_counter() - started
+            if connection is not None:
+                connection.close()
+            connection = None
+        # Requests started during warm-up are not counted
+        if started >= warmup_end:
+            samples.append((route, status, first, total))
+        if args.think_ms:
+            time.sleep(rng.expovariate(1000 / args.think_ms))
+    if connection is not None:
+        connection.close()
+
+
+def summarize(samples, window):
+    def stats(group):
+        ok = []
+        errors = {}
+        for sample in group:
+            if isinstance(sample[1], int) and sample[1] < 400:
+                ok.append(sample)
+            else:
+                errors[str(sample[1])] = errors.get(str(sample[1]), 0) + 1
+        return {
+            'requests': len(group),
+            'errors': errors,
+            'throughput_rps': len(ok) / window,
+            'latency': percentiles([sample[3] for sample in ok]),
+            'first_byte': percentiles([sample[2] for sample in ok]),
+        }
+    routes = {route: stats([sample for sample in samples if sample[0] == route]) for route in sorted({sample[0] for sample in samples})}
+    return routes, stats(samples)
+
+
+def print_report(routes, overall):
+    print(f'{"route":<20} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"first p50":>10}')
+    for route, stats in list(routes.items()) + [('all', overall)]:
+        latency = stats['latency']
+        print(f'{route:<20} {stats["requests"]:>8} {sum(stats["errors"].values()):>6} {stats["throughput_rps"]:>8.2f} {latency["p50_ms"]:>9.1f} {latency["p95_ms"]:>9.1f} {latency["p99_ms"]:>9.1f} {stats["first_byte"]["p50_ms"]:>10.1f}')
+
+
+def compare(report, path):
+    # Relative change against an earlier run; positive latency changes and negative throughput changes are regressions
+    with open(path, 'r') as f:
+        baseline = json.load(f)
+
+    def change(new, old):
+        return f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+
+    print(f'\nChange against {path}')
+    print(f'{"route":<20} {"req/s":>8} {"p50":>8} {"p95":>8} {"p99":>8}')
+    for route, stats in list(report['routes'].items()) + [('all', report['overall'])]:
+        old = baseline['overall'] if route == 'all' else baseline['routes'].get(route)
+        if old is None:
+            continue
+        latency, old_latency = stats['latency'], old['latency']
+        print(f'{route:<20} {change(stats["throughput_rps"], old["throughput_rps"]):>8} {change(latency["p50_ms"], old_latency["p50_ms"]):>8} {change(latency["p95_ms"], old_latency["p95_ms"]):>8} {change(latency["p99_ms"], old_latency["p99_ms"]):>8}')
+    for name, result in report.get('micro', {}).items():
+        old = baseline.get('micro', {}).get(name, {})
+        rows = [(name, result, old)] if 'calls' in result else [(f'{name} {variant}', stats, old.get(variant, {})) for variant, stats in result.items() if isinstance(stats, dict)]
+        for label, stats, old_stats in rows:
+            if 'p50_ms' in stats and 'p50_ms' in old_stats:
+                print(f'{label:<20} {"":>8} {change(stats["p50_ms"], old_stats["p50_ms"]):>8} {change(stats["p95_ms"], old_stats["p95_ms"]):>8} {change(stats["p99_ms"], old_stats["p99_ms"]):>8}')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_process(command, workdir, env, name):
+    log = open(os.path.join(workdir, f'{name}.log'), 'w')
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_for(port, path, timeout, process, name, workdir):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{name} exited with {process.returncode}; see {os.path.join(workdir, name + ".log")}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', path)
+            status = connection.getresponse().status
+            connection.close()
+            if status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'{name} was not ready after {timeout}s; see {os.path.join(workdir, name + ".log")}')
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def get_json(port, path):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('GET', path)
+        return json.loads(connection.getresponse().read())
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        return {'error': str(e)}
+    finally:
+        connection.close()
+
+
+def prepare(args, workdir, env):
+    # The fixture Bible and everything built from it live in the work directory, so no real data or cache is touched
+    marker = os.path.join(workdir, '.prepared')
+    if os.path.exists(marker):
+        print(f'Reusing the prepared fixture in {workdir}')
+        return
+    fixtures.write_bible(os.path.join(workdir, chapterstore.data_dir), chapters_per_book=args.chapters_per_book, verses_per_chapter=args.verses_per_chapter)
+    for script in ('chapterstore.py', 'lexicalindex.py', 'fill_milvus_lite.py'):
+        print(f'Running {script}...')
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, os.path.join(repo, script)], cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if result.returncode != 0:
+            print(result.stdout[-4000:])
+            raise RuntimeError(f'{script} failed with {result.returncode}')
+        print(f'    {time.perf_counter() - start:.1f}s')
+    open(marker, 'w').close()
+
+
+def run(args):
+    weights = parse_mix(args.mix)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='aibible-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    ollama_port = free_port()
+    app_port = args.port or free_port()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [repo, env.get('PYTHONPATH')]))
+    env['OLLAMA_HOST'] = f'http://127.0.0.1:{ollama_port}'
+    env['PROMPT_LOG_SAMPLE'] = '0'
+
+    processes = []
+    report = {'config': {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}}
+    try:
+        prepare(args, workdir, env)
+        fake = start_process([sys.executable, '-m', 'benchmarks.fake_ollama', '--port', str(ollama_port), '--load-ms', str(args.load_ms), '--prefill-ms-per-token', str(args.prefill_ms_per_token), '--decode-ms-per-token', str(args.decode_ms_per_token), '--response-tokens', str(args.response_tokens), '--parallel', str(args.parallel)], workdir, env, 'fake_ollama')
+        processes.append(fake)
+        wait_for(ollama_port, '/api/version', 30, fake, 'fake_ollama', workdir)
+
+        if args.server == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(repo, 'gunicorn.conf.py'), '--bind', f'127.0.0.1:{app_port}']
+        else:
+            command = [sys.executable, '-c', f'import main; main.app.run(host="127.0.0.1", port={app_port}, threaded=True)']
+        app = start_process(command, workdir, env, 'app')
+        processes.append(app)
+        print(f'Waiting for the app ({args.server}) to report ready...')
+        start = time.perf_counter()
+        wait_for(app_port, '/readyz', args.ready_timeout, app, 'app', workdir)
+        report['ready_seconds'] = time.perf_counter() - start
+
+        verses = fixtures.sample_verses(chapters_per_book=args.chapters_per_book, verses_per_chapter=args.verses_per_chapter)
+        samples = []
+        begin = time.perf_counter()
+        warmup_end = begin + args.warmup
+        deadline = warmup_end + args.duration
+        print(f'Sending traffic from {args.concurrency} clients for {args.warmup + args.duration:.0f}s...')
+        threads = [threading.Thread(target=client_loop, args=(i, args, ('127.0.0.1', app_port), verses, weights, warmup_end, deadline, samples)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Requests still running at the deadline finish late, so the window runs until the last one ends
+        window = max(args.duration, time.perf_counter() - warmup_end)
+
+        report['routes'], report['overall'] = summarize(samples, window)
+        report['server'] = {'scheduler': get_json(app_port, '/scheduler-stats'), 'caches': get_json(app_port, '/cache-stats')}
+        print_report(report['routes'], report['overall'])
+
+        # Milvus Lite only opens in one process, so the micro-benchmarks run once the app has stopped
+        stop_process(app)
+        if not args.skip_micro:
+            micro_path = os.path.join(workdir, 'micro.json')
+            subprocess.run([sys.executable, '-m', 'benchmarks.microbench', '--iterations', str(args.micro_iterations), '--json', micro_path], cwd=workdir, env=env)
+            if os.path.exists(micro_path):
+                with open(micro_path, 'r') as f:
+                    report['micro'] = json.load(f)
+                print_results(report['micro'])
+    finally:
+        for process in reversed(processes):
+            stop_process(process)
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif os.path.exists(workdir):
+            print(f'Logs and the fixture are in {workdir}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        compare(report, args.compare)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Boot the app on a fixture Bible against a fake Ollama and drive mixed traffic at it.')
+    parser.add_argument('--server', default='flask', choices=['flask', 'gunicorn'], help='gunicorn uses gunicorn.conf.py; WEB_WORKERS and WEB_THREADS apply.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Simulated readers, each sending one request at a time.')
+    parser.add_argument('--duration', type=float, default=60, help='Measured seconds of traffic.')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds of traffic before measuring starts.')
+    parser.add_argument('--think-ms', type=float, default=0, help='Mean pause between a reader\'s requests.')
+    parser.add_argument('--mix', help=f'Route weights, e.g. "page=50,ask_question=50". Default: {",".join(f"{route}={weight}" for route, weight in mix.items())}.')
+    parser.add_argument('--stream', action='store_true', help='Use the /stream variants where a route has one.')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chapters-per-book', type=int, default=2)
+    parser.add_argument('--verses-per-chapter', type=int, default=8)
+    parser.add_argument('--load-ms', type=float, default=0, help='Fake model load time on the first request to each model.')
+    parser.add_argument('--prefill-ms-per-token', type=float, default=0.5)
+    parser.add_argument('--decode-ms-per-token', type=float, default=15)
+    parser.add_argument('--response-tokens', type=int, default=64)
+    parser.add_argument('--parallel', type=int, default=2, help='Generations the fake Ollama runs at once per model.')
+    parser.add_argument('--port', type=int, help='Port for the app; a free one by default.')
+    parser.add_argument('--ready-timeout', type=float, default=600)
+    parser.add_argument('--workdir', help='Keep the fixture, indexes and logs here; a prepared directory is reused.')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary work directory.')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--micro-iterations', type=int, default=200)
+    parser.add_argument('--json', help='Write the report to this file.')
+    parser.add_argument('--compare', help='Print the change against a report written earlier with --json.')
+    run(parser.parse_args())
@@ -0,0 +1,129 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+import chapterstore
+
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'calls': int(len(latencies)),
+        'mean_ms': float(latencies.mean()) if len(latencies) else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+    }
+
+
+def time_calls(function, inputs, iterations):
+    # Cycles through `inputs` so every call sees a realistic argument
+    latencies = []
+    for i in range(iterations):
+        argument = inputs[i % len(inputs)]
+        start = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def raw_verses(version, directory, limit):
+    # Verse text as stored, red-letter markers included, which is what parse_text sees
+    texts = []
+    for _, book, chapter in chapterstore.iter_chapters([version], chapterstore.in_order, directory):
+        with open(chapterstore.chapter_path(version, book, chapter, directory), 'r') as f:
+            texts.extend(verse['t'] for verse in json.load(f) if 'h' not in verse)
+        if len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def bench_parse_text(texts, iterations):
+    return time_calls(chapterstore.parse_text, texts, iterations)
+
+
+def bench_embedding(texts, iterations, batch_size):
+    import embedding
+    # get_embedding does not cache, so every call is a forward pass
+    embedding.get_embedding(texts[0], mode='query')
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    return {
+        'single': time_calls(lambda text: embedding.get_embedding(text, mode='query'), texts, iterations),
+        f'batch_{batch_size}': time_calls(lambda batch: embedding.get_embedding(batch, mode='sentence'), batches, max(1, iterations // batch_size)),
+    }
+
+
+def bench_search(queries, database, collection, version, iterations):
+    import milvuslitebible
+    import vectorcodec
+    client = milvuslitebible.open_client(f'./{database}.db')
+    client.load_collection(collection)
+    codec = vectorcodec.VectorCodec.load(collection)
+    metric = codec.metric if codec is not None else 'L2'
+    partitions = set(client.list_partitions(collection))
+    partition = version if version in partitions else None
+
+    def search(query):
+        return milvuslitebible.search_collection(query, client, collection, metric, limit=5, partition=partition, codec=codec)
+
+    def uncached(query):
+        # Query embeddings stay cached, so this times the vector search itself
+        milvuslitebible.results_cache.clear()
+        return search(query)
+
+    for query in queries:
+        search(query)
+    results = {'uncached': time_calls(uncached, queries, iterations), 'cached': time_calls(search, queries, iterations)}
+    client.close()
+    return results
+
+
+def run(args):
+    texts = raw_verses(args.version, args.data_dir, max(args.iterations, 64))
+    queries = [' '.join(chapterstore.plain_text(text).split()[:6]) for text in texts[:64]]
+    results = {}
+    benches = {
+        'parse_text': lambda: bench_parse_text(texts, args.iterations),
+        'get_embedding': lambda: bench_embedding(queries, args.iterations, args.batch_size),
+        'search_collection': lambda: bench_search(queries, args.database, args.collection, args.version, args.iterations),
+    }
+    for name in args.only or benches:
+        try:
+            results[name] = benches[name]()
+        except Exception as e:
+            # The model or the index may not be available; the other benchmarks still run
+            results[name] = {'error': f'{type(e).__name__}: {e}'}
+            print(f'{name} skipped: {e}')
+    return results
+
+
+def print_results(results):
+    print(f'{"benchmark":<36} {"calls":>6} {"mean ms":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for name, result in results.items():
+        if 'error' in result:
+            print(f'{name:<36} {result["error"]}')
+            continue
+        rows = [(name, result)] if 'calls' in result else [(f'{name} {variant}', stats) for variant, stats in result.items()]
+        for label, stats in rows:
+            print(f'{label:<36} {stats["calls"]:>6} {stats["mean_ms"]:>9.3f} {stats["p50_ms"]:>9.3f} {stats["p95_ms"]:>9.3f} {stats["p99_ms"]:>9.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time parse_text, get_embedding and search_collection in isolation.')
+    parser.add_argument('--only', nargs='+', choices=['parse_text', 'get_embedding', 'search_collection'])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--version', default='nasb')
+    parser.add_argument('--data-dir', default=chapterstore.data_dir)
+    parser.add_argument('--database', default='milvuslitebible')
+    parser.add_argument('--collection', default='milvuslitebible_bible')
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,73 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+import embedding
+import milvuslitebible
+import numpyindex
+from benchmarks.embedding_backends import load_corpus, make_queries
+
+
+def time_searches(retriever, vectors, k, partition=None):
+    latencies = []
+    results = []
+    for vector in vectors:
+        start = time.perf_counter()
+        results.append(retriever.search_vectors([vector.tolist()], k, partition)[0])
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def compare(args):
+    queries = make_queries(load_corpus(args.corpus, 0), args.queries)
+    # Embed once up front so only the vector search itself is timed
+    vectors = [np.asarray(embedding.get_embedding(query, mode='query'))[0] for query in queries]
+
+    milvus = milvuslitebible.BibleRetriever(args.database, args.collection, args.metric)
+    milvus.connect()
+    numpy_retriever = numpyindex.NumpyRetriever(args.prefix, args.metric)
+    numpy_retriever.connect()
+
+    milvus_results, milvus_latencies = time_searches(milvus, vectors, args.k, milvus.partition(args.version))
+    numpy_results, numpy_latencies = time_searches(numpy_retriever, vectors, args.k, numpy_retriever.partition(args.version))
+
+    start = time.perf_counter()
+    numpy_retriever.search_vectors([vector.tolist() for vector in vectors], args.k, numpy_retriever.partition(args.version))
+    batched = time.perf_counter() - start
+
+    # Milvus Lite uses an exact FLAT index here, so its hits are the ground truth
+    recall = np.mean([len({hit['title'] for hit in a} & {hit['title'] for hit in b}) / args.k for a, b in zip(milvus_results, numpy_results)])
+    report = {
+        'queries': len(queries),
+        'k': args.k,
+        'milvus_p50_ms': float(np.percentile(milvus_latencies, 50) * 1000),
+        'milvus_p95_ms': float(np.percentile(milvus_latencies, 95) * 1000),
+        'numpy_p50_ms': float(np.percentile(numpy_latencies, 50) * 1000),
+        'numpy_p95_ms': float(np.percentile(numpy_latencies, 95) * 1000),
+        'numpy_batched_ms_per_query': batched / len(queries) * 1000,
+        'numpy_dtype': str(numpy_retriever.vectors.dtype),
+        f'recall_at_{args.k}': float(recall),
+    }
+    for key, value in report.items():
+        print(f'{key}: {value}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    milvus.close()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare search latency and recall of the NumPy index against Milvus Lite.')
+    parser.add_argument('--corpus', default='NASB1995_bible.json')
+    parser.add_argument('--database', default='milvuslitebible')
+    parser.add_argument('--collection', default='milvuslitebible_bible')
+    parser.add_argument('--prefix', default='milvuslitebible_bible')
+    parser.add_argument('--metric', default='L2', choices=['L2', 'IP'])
+    parser.add_argument('--version', help='Search only this version partition.')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--json', help='Also write the results to this file.')
+    compare(parser.parse_args())
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import embedding
+import milvuslitebible
+import numpyindex
+import vectorcodec
+from benchmarks.embedding_backends import load_corpus, make_queries
+
+modes = ['none', 'normalize', 'normalize+fp16', 'normalize+fp16+pca192', 'normalize+fp16+pca128']
+
+
+def embed(texts, mode, batch_size):
+    return np.concatenate([np.asarray(embedding.get_embedding(texts[i:i + batch_size], mode=mode), dtype=np.float32) for i in range(0, len(texts), batch_size)])
+
+
+def search_all(retriever, queries, k):
+    latencies = []
+    hits = []
+    for query in queries:
+        start = time.perf_counter()
+        results = retriever.search_vectors([query], k)[0]
+        latencies.append(time.perf_counter() - start)
+        hits.append([int(hit['title']) for hit in results])
+    return hits, latencies
+
+
+def insert_ms(vectors, codec, database_name, rows=2048, batch_size=512):
+    # Time of the real Milvus Lite insert per 1k rows, which is where pymilvus converts every row
+    vectors = vectors[:rows]
+    if vectors.dtype == np.float16:
+        # fp16 is only stored by the NumPy export; fill_milvus_lite.py rejects it
+        return None
+    client = milvuslitebible.create_collection('insert_bench', database_name, vectors, codec.metric)
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(vectors), batch_size):
+            batch = range(i, min(i + batch_size, len(vectors)))
+            if not milvuslitebible.insert_data('insert_bench', client, vectors[i:i + batch_size], ['' for _ in batch], [str(j) for j in batch], list(batch)):
+                return None
+        return (time.perf_counter() - start) * 1000 / (len(vectors) / 1000)
+    finally:
+        client.close()
+
+
+def compare(args):
+    texts = load_corpus(args.corpus, args.limit)
+    query_texts = make_queries(texts, args.queries)
+    print(f'Embedding {len(texts)} verses and {len(query_texts)} queries...')
+    docs = embed(texts, 'sentence', args.batch_size)
+    queries = embed(query_texts, 'query', args.batch_size)
+    titles = [str(i) for i in range(len(texts))]
+
+    results = {}
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.modes:
+            codec = vectorcodec.VectorCodec.from_mode(mode)
+            if codec.needs_fit:
+                codec.fit(docs)
+            prefix = os.path.join(directory, mode.replace('+', '_'))
+            encoded = codec.encode(docs)
+            numpyindex.write_index(prefix, list(range(len(texts))), encoded, titles, texts, dtype=encoded.dtype.name)
+            codec.save(prefix)
+
+            retriever = numpyindex.NumpyRetriever(prefix)
+            retriever.connect()
+            hits, latencies = search_all(retriever, list(codec.encode(queries)), args.k)
+            if baseline is None:
+                # The first mode is the reference, normally the current fp32 L2 setup
+                baseline = hits
+            recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(baseline, hits)])
+            # create_collection opens ./<name>.db, so the temporary database is named relative to the working directory
+            insert = insert_ms(encoded, codec, os.path.relpath(prefix + '_milvus'))
+            results[mode] = {
+                'metric': codec.metric,
+                'dimensions': int(encoded.shape[1]),
+                'dtype': encoded.dtype.name,
+                'vector_mb': encoded.nbytes / (1024 * 1024),
+                'index_file_mb': os.path.getsize(numpyindex.index_paths(prefix)['vectors']) / (1024 * 1024),
+                'search_p50_ms': float(np.percentile(latencies, 50) * 1000),
+                'search_p95_ms': float(np.percentile(latencies, 95) * 1000),
+                f'recall_at_{args.k}': float(recall),
+                'insert_ms_per_1k': insert,
+            }
+            retriever.close()
+
+    print(f'{"mode":<24} {"metric":>6} {"dims":>5} {"MB":>8} {"p50 ms":>8} {"p95 ms":>8} {f"recall@{args.k}":>9} {"insert ms/1k":>13}')
+    for mode, stats in results.items():
+        insert = 'n/a' if stats['insert_ms_per_1k'] is None else f'{stats["insert_ms_per_1k"]:.1f}'
+        print(f'{mode:<24} {stats["metric"]:>6} {stats["dimensions"]:>5} {stats["vector_mb"]:>8.2f} {stats["search_p50_ms"]:>8.3f} {stats["search_p95_ms"]:>8.3f} {stats[f"recall_at_{args.k}"]:>9.3f} {insert:>13}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare recall, memory and search latency of the vector compression modes against fp32 L2.')
+    parser.add_argument('--modes', nargs='+', default=modes, help='The first mode is the reference for recall.')
+    parser.add_argument('--corpus', default='NASB1995_bible.json')
+    parser.add_argument('--limit', type=int, default=0, help='Number of verses to embed; 0 embeds the whole corpus.')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--json', help='Also write the results to this file.')
+    compare(parser.parse_args())
@@ -0,0 +1,60 @@
+import argparse
+import json
+import os
+
+fields = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty', 'Shared_Clean', 'Shared_Dirty')
+
+
+def children(pid):
+    # Linux only: direct children listed per thread of `pid`
+    found = set()
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            found.update(int(child) for child in f.read().split())
+    return sorted(found)
+
+
+def memory(pid):
+    # Pss splits shared pages between the processes mapping them, so it adds up across workers; Rss does not
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in fields:
+                values[name] = int(rest.split()[0]) / 1024
+    values['Uss'] = values['Private_Clean'] + values['Private_Dirty']
+    return values
+
+
+def command(pid):
+    with open(f'/proc/{pid}/cmdline', 'rb') as f:
+        return ' '.join(part.decode('utf-8', 'replace') for part in f.read().split(b'\0') if part)
+
+
+def role(pid, master):
+    if pid == master:
+        return 'master'
+    return 'vector service' if 'vectorservice.py' in command(pid) else 'worker'
+
+
+def measure(master):
+    processes = [master] + children(master)
+    return [{'pid': pid, 'role': role(pid, master), **memory(pid)} for pid in processes]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report RSS, PSS and USS of the gunicorn master, its workers and the vector service.')
+    parser.add_argument('--pidfile', default='gunicorn.pid')
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    with open(args.pidfile) as f:
+        master = int(f.read().strip())
+    rows = measure(master)
+    print(f'{"pid":>8} {"role":<15} {"RSS MB":>8} {"PSS MB":>8} {"USS MB":>8}')
+    for row in rows:
+        print(f'{row["pid"]:>8} {row["role"]:<15} {row["Rss"]:>8.1f} {row["Pss"]:>8.1f} {row["Uss"]:>8.1f}')
+    print(f'{"":>8} {"total":<15} {"":>8} {sum(row["Pss"] for row in rows):>8.1f} {sum(row["Uss"] for row in rows):>8.1f}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=4)
@@ -1,26 +1,109 @@
+import lrucache
+import os
 import requests
-from bs4 import BeautifulSoup
+import threading
 import time
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# Point IMAGE_SEARCH_URL at a local stand-in server to exercise the scraper without reaching Bing
+search_url = os.environ.get('IMAGE_SEARCH_URL', 'https://www.bing.com/images/search')
+# (connect, read) timeouts in seconds
+timeout = (3.05, 10)
+# Parsed image lists are reused for this many seconds
+cache_ttl = 60 * 60
+# Longest a request thread waits for the rate limit before serving a stale result, or none
+max_rate_wait = 1.0
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.headers.update({'User-Agent': 'Mozilla/5.0 (compatible; AI-Bible)'})
+
+# Expired entries stay until evicted so they can still be served while the rate limit is exhausted
+image_cache = lrucache.LRUCache(max_entries=1024, max_bytes=8 * 1024 * 1024, sizeof=lambda entry: sum(len(url) for url in entry[1]))
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='image-search')
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TokenBucket:
+    # Allows short bursts of `capacity` requests while holding the average to `rate` per second
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-def getdata(url):
-    r = requests.get(url)
+    def acquire(self, max_wait):
+        # False without sleeping when a token would take longer than `max_wait` seconds to come in
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+rate_limiter = TokenBucket(rate=1.0, capacity=4)
+
+
+def getdata(url, params=None):
+    if not rate_limiter.acquire(max_rate_wait):
+        raise RateLimited(f'More than {rate_limiter.rate:g} image searches per second')
+    r = session.get(url, params=params, timeout=timeout)
+    r.raise_for_status()
     return r.text
 
 
+def normalize_query(prompt):
+    return ' '.join(prompt.replace('+', ' ').split()).lower()
+
+
 def search(prompt):
-    htmldata = getdata(f'https://www.bing.com/images/search?q={prompt.replace(' ', '+')}+bible')
+    query = normalize_query(prompt)
+    entry = image_cache.get(query)
+    if entry is not None and entry[0] > time.monotonic():
+        return list(entry[1])
+
+    try:
+        htmldata = getdata(search_url, params={'q': f'{query} bible'})
+    except RateLimited as e:
+        print(f'Image search for {query} skipped: {e}')
+        return list(entry[1]) if entry is not None else []
+    except requests.RequestException as e:
+        print(f'Image search for {query} failed: {e}')
+        return []
     images = []
     soup = BeautifulSoup(htmldata, 'html.parser')
-    time.sleep(1)
     for item in soup.find_all('img', class_='mimg'):
         try:
             images.append(item['src'])
         except Exception as e:
             continue
 
+    image_cache.put(query, (time.monotonic() + cache_ttl, tuple(images)))
     return images
 
 
 def searchmap(prompt):
-    images = search(f'{prompt}+map')
+    images = search(f'{prompt} map')
     return images
+
+
+def search_all(prompt):
+    # Images and maps are fetched concurrently instead of one after the other
+    images = executor.submit(search, prompt)
+    maps = executor.submit(searchmap, prompt)
+    return images.result(), maps.result()
@@ -0,0 +1,216 @@
+import argparse
+import json
+import lrucache
+import metrics
+import mmap
+import os
+import re
+import struct
+import threading
+
+data_dir = 'bible-data/data'
+pack_magic = b'BIBLEPK1'
+
+in_order = [
+    "Genesis", "Exodus", "Leviticus", "Numbers", "Deuteronomy", "Joshua",
+    "Judges", "Ruth", "1 Samuel", "2 Samuel", "1 Kings", "2 Kings",
+    "1 Chronicles", "2 Chronicles", "Ezra", "Nehemiah", "Esther", "Job",
+    "Psalm", "Proverbs", "Ecclesiastes", "Song of Solomon", "Isaiah",
+    "Jeremiah", "Lamentations", "Ezekiel", "Daniel", "Hosea", "Joel",
+    "Amos", "Obadiah", "Jonah", "Micah", "Nahum", "Habakkuk", "Zephaniah",
+    "Haggai", "Zechariah", "Malachi", "Matthew", "Mark", "Luke", "John",
+    "Acts", "Romans", "1 Corinthians", "2 Corinthians", "Galatians",
+    "Ephesians", "Philippians", "Colossians", "1 Thessalonians",
+    "2 Thessalonians", "1 Timothy", "2 Timothy", "Titus", "Philemon",
+    "Hebrews", "James", "1 Peter", "2 Peter", "1 John", "2 John",
+    "3 John", "Jude", "Revelation"
+]
+
+version_selection = ['csb', 'esv', 'kjv', 'nasb', 'niv', 'nkjv']
+book_numbers = {book: i + 1 for i, book in enumerate(in_order)}
+verse_number_pattern = re.compile(r'\d+')
+
+
+class ChapterNotFound(KeyError):
+    pass
+
+
+def parse_text(text):
+    words = text.split()
+    parsed_words = []
+
+    for word in words:
+        # Check if the word contains '*', indicating it has attributes
+        if '*' in word:
+            base_word, attributes = word.split('*', 1)
+
+            # If 'r' is in the attributes, wrap the base word in a span
+            if 'r' in attributes:
+                parsed_word = f'<span style="color:red;">{base_word}</span>'
+            else:
+                parsed_word = base_word  # Ignore other attributes
+        else:
+            parsed_word = word  # Word without attributes
+
+        parsed_words.append(parsed_word)
+
+    # Join parsed words back into a single string
+    return ' '.join(parsed_words)
+
+
+def plain_text(text):
+    # Verse text without the red-letter markers, as it is embedded and indexed
+    return ' '.join(word.split('*', 1)[0] for word in text.split())
+
+
+def verse_id(book, chapter, verse):
+    # BBCCCVVV, so the same verse has the same id in every version
+    return book_numbers[book] * 1000000 + int(chapter) * 1000 + int(verse)
+
+
+def render_chapter(json_file):
+    # Headings and red-letter spans are resolved once here instead of on every page view
+    verses = []
+    for verse in json_file:
+        if 'h' in verse and verse['h'] == 2:
+            verses.append(f'<span style="font-weight: bold;">{verse["t"]}</span>')
+        elif 'h' not in verse:
+            verses.append(f'{verse["r"].split(":")[-1]}) {parse_text(verse["t"])}')
+    return tuple(verses)
+
+
+def chapter_path(version, book, chapter, directory=data_dir):
+    return f'{directory}/{version}/books/{book}/chapters/{chapter}/{chapter}.json'
+
+
+def read_chapter(version, book, chapter, directory=data_dir):
+    with open(chapter_path(version, book, chapter, directory), 'r') as f:
+        return render_chapter(json.loads(f.read()))
+
+
+def iter_chapters(versions, books, directory=data_dir):
+    for version in versions:
+        for book in books:
+            chapters_dir = f'{directory}/{version}/books/{book}/chapters'
+            for chapter in sorted(os.listdir(chapters_dir), key=int):
+                yield version, book, chapter
+
+
+def iter_verse_texts(version, books=in_order, directory=data_dir):
+    # (book, chapter, verse number, plain text) for every verse of one version, headings skipped
+    for _, book, chapter in iter_chapters([version], books, directory):
+        with open(chapter_path(version, book, chapter, directory), 'r') as f:
+            for verse in json.loads(f.read()):
+                if 'h' in verse:
+                    continue
+                number = verse_number_pattern.match(verse['r'].split(':')[-1])
+                if number is not None:
+                    yield book, chapter, number.group(), plain_text(verse['t'])
+
+
+def count_chapters(books, version, directory=data_dir):
+    return {book: len(os.listdir(f'{directory}/{version}/books/{book}/chapters')) for book in books}
+
+
+def build_manifest(path, books, version, directory=data_dir):
+    # Chapter counts per book, so startup does not have to walk the data tree
+    manifest = count_chapters(books, version, directory)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    print(f'Wrote chapter counts for {len(manifest)} books to {path}')
+
+
+def load_manifest(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def build_pack(path, versions, books, directory=data_dir):
+    # Layout: magic, little-endian index length, JSON index of (offset, length), then the chapter blobs
+    index = {}
+    blobs = []
+    offset = 0
+    for version, book, chapter in iter_chapters(versions, books, directory):
+        blob = json.dumps(read_chapter(version, book, chapter, directory), ensure_ascii=False).encode('utf-8')
+        index[f'{version}/{book}/{chapter}'] = (offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+    index_bytes = json.dumps(index).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(pack_magic)
+        f.write(struct.pack('<Q', len(index_bytes)))
+        f.write(index_bytes)
+        for blob in blobs:
+            f.write(blob)
+    print(f'Packed {len(index)} chapters into {path} ({os.path.getsize(path)} bytes)')
+
+
+class ChapterStore:
+    # Pre-rendered chapters served from memory, read from a packed memory-mapped file or the JSON tree
+    def __init__(self, versions, books, directory=data_dir, pack_path=None, max_bytes=64 * 1024 * 1024):
+        self.versions = set(versions)
+        self.books = set(books)
+        self.directory = directory
+        self.cache = lrucache.LRUCache(max_entries=len(self.versions) * 1189, max_bytes=max_bytes, sizeof=lambda verses: sum(len(verse) for verse in verses))
+        self.pack = None
+        self.index = {}
+        self.lock = threading.Lock()
+        if pack_path is not None:
+            self.open_pack(pack_path)
+
+    def open_pack(self, path):
+        with open(path, 'rb') as f:
+            pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if pack[:8] != pack_magic:
+            pack.close()
+            raise ValueError(f'{path} is not a chapter pack')
+        index_length = struct.unpack('<Q', pack[8:16])[0]
+        base = 16 + index_length
+        self.index = {key: (base + offset, length) for key, (offset, length) in json.loads(pack[16:base]).items()}
+        self.pack = pack
+        print(f'Opened chapter pack {path} with {len(self.index)} chapters.')
+
+    def get(self, book, chapter, version):
+        if version not in self.versions or book not in self.books or not chapter.isdigit():
+            raise ChapterNotFound(f'{book} {chapter} ({version}) is not available')
+        key = f'{version}/{book}/{chapter}'
+        verses = self.cache.get(key)
+        if verses is None:
+            with metrics.span('chapter_load'):
+                if self.pack is not None:
+                    if key not in self.index:
+                        raise ChapterNotFound(f'{book} {chapter} ({version}) is not available')
+                    offset, length = self.index[key]
+                    verses = tuple(json.loads(self.pack[offset:offset + length]))
+                else:
+                    try:
+                        verses = read_chapter(version, book, chapter, self.directory)
+                    except FileNotFoundError:
+                        raise ChapterNotFound(f'{book} {chapter} ({version}) is not available')
+            self.cache.put(key, verses)
+        return verses
+
+    def preload(self, versions=None):
+        count = 0
+        for version, book, chapter in iter_chapters(versions or sorted(self.versions), sorted(self.books), self.directory):
+            self.get(book, chapter, version)
+            count += 1
+        print(f'Preloaded {count} chapters.')
+
+    def close(self):
+        with self.lock:
+            if self.pack is not None:
+                self.pack.close()
+                self.pack = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the chapter manifest and pack every pre-rendered chapter into a single memory-mappable file.')
+    parser.add_argument('--output', default='chapters.pack')
+    parser.add_argument('--manifest', default='manifest.json')
+    parser.add_argument('--manifest-version', default='nasb')
+    parser.add_argument('--data-dir', default=data_dir)
+    args = parser.parse_args()
+
+    build_manifest(args.manifest, in_order, args.manifest_version, args.data_dir)
+    build_pack(args.output, version_selection, in_order, args.data_dir)
@@ -0,0 +1,117 @@
+import chapterstore
+import lexicalindex
+import metrics
+import os
+import threading
+
+# Tokens of context verses allowed in one prompt, measured with the generation model's tokenizer
+token_budget = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '320'))
+# Hugging Face tokenizer matching the Ollama model; only used when it is already downloaded
+tokenizer_name = os.environ.get('CONTEXT_TOKENIZER', 'Qwen/Qwen2.5-1.5B-Instruct')
+# Candidates fetched per search so diversification has something to choose from
+candidates = 10
+max_verses = 5
+# Relevance against novelty when picking the next verse (1.0 is plain ranking)
+mmr_lambda = 0.7
+# Reciprocal-rank constant used to turn search positions into relevance scores
+rank_k = 10
+
+tokenizer = None
+tokenizer_lock = threading.Lock()
+book_order = {book: i for i, book in enumerate(chapterstore.in_order)}
+
+
+def load_tokenizer():
+    global tokenizer
+    with tokenizer_lock:
+        if tokenizer is None:
+            try:
+                # The bare tokenizers library; transformers would import torch into every web worker
+                from huggingface_hub import hf_hub_download
+                from tokenizers import Tokenizer
+                tokenizer = Tokenizer.from_file(hf_hub_download(tokenizer_name, 'tokenizer.json', local_files_only=True))
+            except Exception as e:
+                print(f'{tokenizer_name} tokenizer is not available ({e}). Estimating tokens from characters.')
+                tokenizer = False
+    return tokenizer
+
+
+def count_tokens(text):
+    loaded = tokenizer if tokenizer is not None else load_tokenizer()
+    if loaded:
+        return len(loaded.encode(text, add_special_tokens=False).ids)
+    # Roughly four characters per token for English prose
+    return len(text) // 4 + 1
+
+
+def verse_line(candidate):
+    return f"\"{candidate['text']}\" - {candidate['title']}"
+
+
+def reference(book, chapter, verse):
+    return f'{book} {chapter}:{verse}'
+
+
+def canonical_key(title):
+    # "1 Samuel 3:10" sorts by book order, then chapter and verse
+    book, _, location = title.rpartition(' ')
+    chapter, _, verse = location.partition(':')
+    if not chapter.isdigit() or not verse.isdigit():
+        return (len(book_order), 0, 0, title)
+    return (book_order.get(book, len(book_order)), int(chapter), int(verse), title)
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+@metrics.timed('context')
+def select(searches, exclude=(), budget=None, limit=max_verses):
+    # Merge ranked result lists, drop the passage being read, then pick verses by maximal marginal relevance
+    budget = token_budget if budget is None else budget
+    excluded = set(exclude)
+    pool = {}
+    for results in searches:
+        for rank, candidate in enumerate(results):
+            title = candidate['title']
+            if title in excluded:
+                continue
+            entry = pool.get(title)
+            if entry is None:
+                entry = pool[title] = {'candidate': candidate, 'relevance': 0.0, 'terms': set(lexicalindex.tokenize(candidate['text']))}
+            entry['relevance'] += 1 / (rank_k + rank + 1)
+    if not pool:
+        return []
+
+    top = max(entry['relevance'] for entry in pool.values())
+    remaining = sorted(pool.values(), key=lambda entry: (-entry['relevance'], canonical_key(entry['candidate']['title'])))
+    chosen = []
+    used = 0
+    while remaining and len(chosen) < limit:
+        best = None
+        best_score = None
+        for entry in remaining:
+            redundancy = max((similarity(entry['terms'], other['terms']) for other in chosen), default=0.0)
+            score = mmr_lambda * entry['relevance'] / top - (1 - mmr_lambda) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = entry, score
+        remaining.remove(best)
+        cost = count_tokens(verse_line(best['candidate']))
+        if used + cost > budget:
+            # A long verse is skipped so shorter ones can still fill the budget
+            continue
+        used += cost
+        chosen.append(best)
+
+    # Canonical order keeps the prompt identical for the same set of verses, whatever order search returned them in
+    return sorted((entry['candidate'] for entry in chosen), key=lambda candidate: canonical_key(candidate['title']))
+
+
+def context_string(verses):
+    return ''.join(f"Context verse {i + 1}: {verse_line(verse)}\n" for i, verse in enumerate(verses))
+
+
+def build(searches, exclude=(), budget=None, limit=max_verses):
+    return context_string(select(searches, exclude, budget, limit))
@@ -0,0 +1,115 @@
+import array
+import threading
+import time
+from collections import OrderedDict
+
+
+class Session:
+    # One reader's conversation about one chapter; `context` is the token state Ollama returned after the last turn
+    def __init__(self, key, prefix):
+        self.key = key
+        self.prefix = prefix
+        self.context = None
+        self.questions = 0
+        self.turns = 0
+        # Set once the chapter text alone leaves no room below the cap; later questions are then asked standalone
+        self.too_long = False
+        self.restarted = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def begin(self, build_turn):
+        # Returns the prompt and generate options for the next turn, or None to answer with a standalone prompt
+        if not self.lock.acquire(blocking=False):
+            # This reader's previous turn is still generating, so the context cannot be extended yet
+            return None
+        self.last_used = time.monotonic()
+        self.questions += 1
+        if self.questions == 1 or self.too_long:
+            # Most readers ask one question per chapter: the first keeps the short, cacheable standalone prompt,
+            # and only a follow-up pays for prefilling the whole chapter
+            self.lock.release()
+            return None
+        try:
+            turn = build_turn()
+            self.restarted = self.context is None
+            if self.restarted:
+                return self.prefix() + turn, {}
+        except BaseException:
+            self.lock.release()
+            raise
+        # Ollama only has to prefill the new turn when the context matches what it already holds
+        return turn, {'context': self.context.tolist()}
+
+    def finish(self, context, max_context_tokens):
+        # A failed or cancelled turn keeps the previous context; an overlong one starts over from the chapter text
+        try:
+            if context:
+                self.context = array.array('l', context) if len(context) <= max_context_tokens else None
+                # Starting over would overflow again on every turn, so nothing would ever be reused
+                self.too_long = self.context is None and self.restarted
+                self.turns += 1
+            self.last_used = time.monotonic()
+        finally:
+            self.lock.release()
+
+    def size(self):
+        return len(self.context) * self.context.itemsize if self.context is not None else 0
+
+
+class SessionStore:
+    # Bounded set of conversations: least recently used sessions are dropped at the cap and idle ones expire
+    def __init__(self, max_sessions=64, idle_timeout=15 * 60, max_context_tokens=3072):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_context_tokens = max_context_tokens
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def open(self, session_id, key, prefix):
+        # `prefix` is only called when a turn has to start from the chapter text
+        with self.lock:
+            self.sweep()
+            session = self.sessions.get(session_id)
+            if session is not None and session.key == key:
+                self.sessions.move_to_end(session_id)
+                self.reused += 1
+                return session
+            # A new reader, or a reader who moved to another chapter or model
+            session = Session(key, prefix)
+            self.sessions[session_id] = session
+            self.sessions.move_to_end(session_id)
+            self.created += 1
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+            return session
+
+    def sweep(self):
+        # Callers hold self.lock; sessions are ordered by last use so expired ones are at the front
+        cutoff = time.monotonic() - self.idle_timeout
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_used > cutoff:
+                break
+            del self.sessions[session_id]
+            self.expired += 1
+
+    def finish(self, session, context):
+        session.finish(context, self.max_context_tokens)
+
+    def stats(self):
+        with self.lock:
+            self.sweep()
+            return {
+                'sessions': len(self.sessions),
+                'context_bytes': sum(session.size() for session in self.sessions.values()),
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted,
+                'expired': self.expired,
+            }
@@ -0,0 +1,18 @@
+import os
+import random
+import threading
+
+# Fraction of requests whose prompts and responses are printed; 0 turns prompt logging off
+sample_rate = float(os.environ.get('PROMPT_LOG_SAMPLE', '0'))
+
+current = threading.local()
+
+
+def begin():
+    # Decided once per request so a sampled request logs its prompt and its response together
+    current.sampled = sample_rate > 0 and random.random() < sample_rate
+
+
+def log(label, text):
+    if getattr(current, 'sampled', False):
+        print(f'({label}) {text}')
@@ -0,0 +1,98 @@
+import argparse
+import chapterstore
+import json
+import os
+import re
+import threading
+
+dictionary_path = 'dictionary.json'
+word_pattern = re.compile(r"[a-z]+")
+
+table = None
+table_lock = threading.Lock()
+
+
+def wordnet_synset(word):
+    # nltk loads on first use; the corpus is never downloaded at runtime
+    from nltk.corpus import wordnet2022
+    try:
+        synsets = wordnet2022.synsets(word)
+    except LookupError:
+        print('WordNet 2022 is not installed. Run `python -m nltk.downloader wordnet2022` to enable dictionary context.')
+        return None
+    if not synsets:
+        return None
+    return synsets[0]
+
+
+def synset_info(synset):
+    definition = synset.definition()
+    synonyms = synset.lemma_names()
+    for pointer in range(len(synonyms)):
+        synonyms[pointer] = str(synonyms[pointer]).replace('_', ' ')
+    return definition, synonyms
+
+
+def iter_word_forms(versions, books, directory=chapterstore.data_dir):
+    for version, book, chapter in chapterstore.iter_chapters(versions, books, directory):
+        with open(chapterstore.chapter_path(version, book, chapter, directory), 'r') as f:
+            for verse in json.load(f):
+                if 'h' not in verse:
+                    # Drop red-letter and other word attributes before splitting into words
+                    text = ' '.join(word.split('*', 1)[0] for word in verse['t'].split())
+                    yield from word_pattern.findall(text.lower())
+
+
+def build_dictionary(path, versions, books, directory=chapterstore.data_dir):
+    # WordNet already lemmatizes inside synsets(), so every inflected form maps to its lemma's first synset
+    from nltk.corpus import wordnet2022
+    # Fails here rather than recording every word as a miss when the corpus is not installed
+    wordnet2022.ensure_loaded()
+    forms = {}
+    entries = {}
+    for form in sorted(set(iter_word_forms(versions, books, directory))):
+        synset = wordnet_synset(form)
+        if synset is None:
+            # Names and function words are stored as misses so lookups never fall through to WordNet
+            forms[form] = None
+            continue
+        if synset.name() not in entries:
+            entries[synset.name()] = synset_info(synset)
+        forms[form] = synset.name()
+    with open(path, 'w') as f:
+        json.dump({'forms': forms, 'entries': entries}, f, separators=(',', ':'))
+    print(f'Wrote {len(forms)} word forms ({sum(name is None for name in forms.values())} without a definition) and {len(entries)} definitions to {path}')
+
+
+def load(path=dictionary_path):
+    global table
+    with table_lock:
+        if table is None and os.path.exists(path):
+            with open(path, 'r') as f:
+                table = json.load(f)
+    return table
+
+
+def get_word_info(word):
+    # Bible vocabulary comes from the prebuilt table; only unseen words touch WordNet
+    loaded = load()
+    key = word.strip().lower()
+    if loaded is not None and key in loaded['forms']:
+        name = loaded['forms'][key]
+        if name is None:
+            return None
+        definition, synonyms = loaded['entries'][name]
+        return definition, list(synonyms)
+    synset = wordnet_synset(word)
+    if synset is None:
+        return None
+    return synset_info(synset)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract WordNet definitions and synonyms for every word in the bundled Bible versions.')
+    parser.add_argument('--output', default=dictionary_path)
+    parser.add_argument('--data-dir', default=chapterstore.data_dir)
+    args = parser.parse_args()
+
+    build_dictionary(args.output, chapterstore.version_selection, chapterstore.in_order, args.data_dir)
@@ -1,20 +1,115 @@
+from concurrent.futures import Future
 from typing import Union
-import torch
-from transformers import AutoModel, AutoTokenizer
+import argparse
+import atexit
+import lrucache
+import metrics
+import numpy as np
+import os
+import queue
+import threading
+import time
 
-model = AutoModel.from_pretrained("avsolatorio/NoInstruct-small-Embedding-v0")
-tokenizer = AutoTokenizer.from_pretrained("avsolatorio/NoInstruct-small-Embedding-v0")
+model_name = "avsolatorio/NoInstruct-small-Embedding-v0"
+# "torch" runs the fp32 PyTorch model, "onnx" the exported graph, "onnx-int8" the dynamically quantized graph
+backend = os.environ.get('EMBEDDING_BACKEND', 'torch')
+onnx_paths = {'onnx': 'embedding.onnx', 'onnx-int8': 'embedding.int8.onnx'}
+model = None
+tokenizer = None
+model_lock = threading.Lock()
 
+# Query vectors keyed on normalized text + mode so repeated lookups skip the forward pass
+embedding_cache = lrucache.LRUCache(max_entries=4096, max_bytes=16 * 1024 * 1024, sizeof=lambda vector: vector.nbytes)
 
-def get_embedding(text: Union[str, list[str]], mode: str = "sentence"):
-    model.eval()
+# Requests arriving within batch_window seconds of each other share one forward pass
+batch_window = 0.005
+max_batch_size = 32
 
-    assert mode in ("query", "sentence"), f"mode={mode} was passed but only `query` and `sentence` are the supported."
+
+def from_pretrained(cls):
+    # Never reaches the Hugging Face hub; `python embedding.py` downloads the model once
+    try:
+        return cls.from_pretrained(model_name, local_files_only=True)
+    except OSError as e:
+        raise OSError(f'{model_name} is not cached locally. Run `python embedding.py` to download it.') from e
+
+
+def download():
+    from transformers import AutoModel, AutoTokenizer
+    for cls in (AutoTokenizer, AutoModel):
+        cls.from_pretrained(model_name)
+    print(f'Downloaded {model_name}')
+
+
+def load_torch_model():
+    from transformers import AutoModel
+    loaded_model = from_pretrained(AutoModel)
+    loaded_model.eval()
+    return loaded_model
+
+
+def export_onnx(path=onnx_paths['onnx'], quantized_path=onnx_paths['onnx-int8']):
+    # One-off export of the torch model; the int8 graph quantizes the weights of the exported one
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    torch_model = load_torch_model()
+    inp = load_tokenizer()(["In the beginning God created the heavens and the earth."], return_tensors="pt")
+    # Positional in BertModel.forward order; the names must line up with the tensors they are bound to
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    torch.onnx.export(torch_model, tuple(inp[name] for name in input_names), path, input_names=input_names, output_names=['last_hidden_state'], dynamic_axes=dynamic_axes, opset_version=17)
+    print(f'Exported {model_name} to {path}')
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    print(f'Quantized {path} to {quantized_path}')
+
+
+def load_onnx_session(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'{path} does not exist. Run `python embedding.py --onnx` to export it.')
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+
+def load_tokenizer():
+    from transformers import AutoTokenizer
+    return from_pretrained(AutoTokenizer)
+
+
+def load_model():
+    # The backend and its model load on first use so importing this module stays cheap
+    global model, tokenizer
+    with model_lock:
+        if model is None:
+            assert backend in ("torch", "onnx", "onnx-int8"), f"backend={backend} was passed but only `torch`, `onnx` and `onnx-int8` are supported."
+            loaded_tokenizer = load_tokenizer()
+            model = load_torch_model() if backend == "torch" else load_onnx_session(onnx_paths[backend])
+            tokenizer = loaded_tokenizer
+    return model, tokenizer
+
+
+def tokenize(text: Union[str, list[str]]):
+    _, tokenizer = load_model()
 
     if isinstance(text, str):
         text = [text]
 
-    inp = tokenizer(text, return_tensors="pt", padding=True, truncation=True)
+    return tokenizer(text, return_tensors="pt" if backend == "torch" else "np", padding=True, truncation=True)
+
+
+def embed_tokens(inp, mode: str = "sentence"):
+    assert mode in ("query", "sentence"), f"mode={mode} was passed but only `query` and `sentence` are the supported."
+    if backend == "torch":
+        return embed_tokens_torch(inp, mode)
+    return embed_tokens_onnx(inp, mode)
+
+
+def embed_tokens_torch(inp, mode):
+    import torch
+    model, _ = load_model()
 
     with torch.no_grad():
         output = model(**inp)
@@ -31,8 +126,148 @@ def get_embedding(text: Union[str, list[str]], mode: str = "sentence"):
     return vectors
 
 
+def embed_tokens_onnx(inp, mode):
+    session, _ = load_model()
+    feed = {node.name: inp[node.name].astype(np.int64) for node in session.get_inputs()}
+    last_hidden_state = session.run(['last_hidden_state'], feed)[0]
+
+    # Same pooling as the torch backend: masked mean for queries, [CLS] for sentences
+    if mode == "query":
+        mask = inp["attention_mask"].astype(np.float32)[:, :, None]
+        return (last_hidden_state * mask).sum(axis=1) / mask.sum(axis=1)
+    return last_hidden_state[:, 0, :]
+
+
+def get_embedding(text: Union[str, list[str]], mode: str = "sentence"):
+    assert mode in ("query", "sentence"), f"mode={mode} was passed but only `query` and `sentence` are the supported."
+    return embed_tokens(tokenize(text), mode)
+
+
+def token_lengths(texts):
+    # Unpadded token counts, used to bucket texts of similar length into the same batch
+    _, tokenizer = load_model()
+    return [len(ids) for ids in tokenizer(texts, truncation=True)["input_ids"]]
+
+
 def embed_documents(docs, embed_type="sentence"):
     # Compute embeddings
     embeds = get_embedding(docs, mode=embed_type)
     return embeds
 
+
+def normalize_text(text):
+    # The tokenizer is uncased, so case and runs of whitespace do not change the embedding
+    return ' '.join(text.split()).casefold()
+
+
+class EmbeddingBatcher:
+    # Coalesces embedding requests from all request threads into padded batches on one worker thread
+    def __init__(self, window=batch_window, max_size=max_batch_size):
+        self.window = window
+        self.max_size = max_size
+        self.requests = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='embedding-batcher', daemon=True)
+                self.thread.start()
+
+    def submit(self, texts, mode="query"):
+        # A list of texts submitted together is always embedded in the same forward pass
+        assert mode in ("query", "sentence"), f"mode={mode} was passed but only `query` and `sentence` are the supported."
+        self.start()
+        future = Future()
+        self.requests.put((list(texts), mode, future))
+        return future
+
+    def embed(self, text, mode="query"):
+        return self.submit([text], mode).result()[0]
+
+    def embed_many(self, texts, mode="query"):
+        return self.submit(texts, mode).result()
+
+    def collect(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        count = len(first[0])
+        deadline = time.monotonic() + self.window
+        while count < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)
+                break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            if batch is None:
+                return
+            for mode in ("query", "sentence"):
+                items = [item for item in batch if item[1] == mode]
+                if not items:
+                    continue
+                texts = [text for item in items for text in item[0]]
+                try:
+                    vectors = np.asarray(get_embedding(texts, mode=mode))
+                except Exception as e:
+                    for item in items:
+                        item[2].set_exception(e)
+                    continue
+                start = 0
+                for item in items:
+                    end = start + len(item[0])
+                    item[2].set_result(vectors[start:end])
+                    start = end
+
+    def close(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                self.requests.put(None)
+                self.thread.join(timeout=5)
+            self.thread = None
+
+
+batcher = EmbeddingBatcher()
+atexit.register(batcher.close)
+
+
+def get_cached_embedding(text, mode="query"):
+    return get_cached_embeddings([text], mode)[0]
+
+
+def get_cached_embeddings(texts, mode="query"):
+    keys = [(normalize_text(text), mode) for text in texts]
+    vectors = [embedding_cache.get(key) for key in keys]
+    missing = [i for i in range(len(texts)) if vectors[i] is None]
+    if missing:
+        # All cache misses go through the batcher together so they share one forward pass
+        with metrics.span('embedding'):
+            computed = batcher.embed_many([' '.join(texts[i].split()) for i in missing], mode)
+        for i, vector in zip(missing, computed):
+            vectors[i] = vector
+            embedding_cache.put(keys[i], vector)
+    return vectors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f'Download {model_name} into the Hugging Face cache so the app can load it offline.')
+    parser.add_argument('--onnx', action='store_true', help='Also export the ONNX and int8 ONNX graphs used by EMBEDDING_BACKEND=onnx and onnx-int8.')
+    args = parser.parse_args()
+
+    download()
+    if args.onnx:
+        export_onnx()
@@ -1,35 +1,227 @@
-import json
+import hashlib
+import os
+import queue
+import threading
+import time
 
+import chapterstore
 import embedding
 import milvuslitebible
+import numpy as np
+import vectorcodec
 
 dbname = 'milvuslitebible'
-cname = 'milvuslitebible_nasb1995'
-
-client = milvuslitebible.get_database(dbname)
-if not client.list_collections():
-    with open("NASB1995_bible.json", "r", encoding='utf-8-sig') as file:
-        bible_json = json.load(file)
-    id_count = 0
-    for book in bible_json:
-        for chapter in bible_json[book]:
-            titles = []
-            texts = []
-            ids = []
-            embeddings = None
-            for verse in bible_json[book][chapter]:
-                titles.append(f'{book} {chapter}:{verse}')
-                texts.append(bible_json[book][chapter][verse])
-                ids.append(id_count)
-                id_count += 1
-            embeddings = embedding.get_embedding(text=texts, mode='sentence')
-            if not client.list_collections():
-                client = milvuslitebible.create_collection(collection_name=cname, database_name=dbname, embeddings=embeddings, metric='L2')
-                print(f'Collection {cname} does not exist. Created collection {cname}.')
-            milvuslitebible.insert_data(collection_name=cname, client=client, embeddings=embeddings, texts=texts, titles=titles, ids=ids)
-            print(f'Inserted {book} {chapter}')
-else:
+cname = 'milvuslitebible_bible'
+# Every version goes into its own partition of the one collection
+versions = chapterstore.version_selection
+data_dir = chapterstore.data_dir
+# Row ids are version number * version_stride + verse id, so a verse keeps the same verse id in every version
+version_stride = 100000000
+checkpoint_path = f'{cname}.checkpoint'
+# See vectorcodec.py; changing it rebuilds the collection
+compression = vectorcodec.default_mode
+# Verses embedded up front to fit the PCA projection when the compression asks for one
+fit_sample = 4096
+batch_size = 64
+# Batches allowed to wait between pipeline stages
+queue_size = 4
+
+
+def row_id(version, verse_id):
+    return (chapterstore.version_selection.index(version) + 1) * version_stride + verse_id
+
+
+def iter_verses(versions, directory=data_dir):
+    for version in versions:
+        for book, chapter, verse, text in chapterstore.iter_verse_texts(version, chapterstore.in_order, directory):
+            verse_id = chapterstore.verse_id(book, chapter, verse)
+            yield row_id(version, verse_id), version, verse_id, f'{book} {chapter}:{verse}', text
+
+
+def text_hash(title, text):
+    return hashlib.sha1(f'{title}\n{text}'.encode('utf-8')).hexdigest()
+
+
+def load_checkpoint(path):
+    # Append-only log of "id<TAB>hash" lines; the last line for an id wins and "-" marks a deletion
+    done = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 2 or not parts[0].isdigit() or not parts[1]:
+                    # A torn last line from an interrupted run
+                    continue
+                if parts[1] == '-':
+                    done.pop(int(parts[0]), None)
+                else:
+                    done[int(parts[0])] = parts[1]
+    return done
+
+
+def plan_batches(verses, size):
+    # Verses of similar token length share a batch so little of each forward pass is spent on padding
+    lengths = embedding.token_lengths([verse[2] for verse in verses])
+    order = sorted(range(len(verses)), key=lambda i: lengths[i])
+    return [[verses[i] for i in order[start:start + size]] for start in range(0, len(order), size)]
+
+
+def tokenize_stage(batches, tokenized, errors):
+    try:
+        for batch in batches:
+            tokenized.put((batch, embedding.tokenize([verse[2] for verse in batch])))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        tokenized.put(None)
+
+
+def fit_codec(codec, verses):
+    # A sample spread over the whole Bible, embedded exactly like the verses that will be stored
+    step = max(1, len(verses) // fit_sample)
+    texts = [verse[2] for verse in verses[::step][:fit_sample]]
+    sample = np.concatenate([np.asarray(embedding.get_embedding(texts[i:i + batch_size], mode='sentence')) for i in range(0, len(texts), batch_size)])
+    codec.fit(sample)
+    print(f'Fitted a {codec.dimensions}-dimension PCA projection on {len(texts)} verses.')
+
+
+def insert_batch(client, batch, vectors):
+    # A batch is sorted by length, not version, so it is split into one insert per partition
+    for version in sorted(set(verse[4] for verse in batch)):
+        rows = [i for i in range(len(batch)) if batch[i][4] == version]
+        ids = [batch[i][0] for i in rows]
+        titles = [batch[i][1] for i in rows]
+        texts = [batch[i][2] for i in rows]
+        verse_ids = [batch[i][5] for i in rows]
+        if not milvuslitebible.insert_data(collection_name=cname, client=client, embeddings=vectors[rows], texts=texts, titles=titles, ids=ids, upsert=True, partition_name=version, verse_ids=verse_ids):
+            raise RuntimeError(f'Inserting {titles[0]}..{titles[-1]} ({version}) failed')
+
+
+def insert_stage(client, codec, embedded, checkpoint, progress, errors):
+    created = None
+    try:
+        while True:
+            item = embedded.get()
+            if item is None:
+                return
+            if errors:
+                # Keep draining so the other stages can finish after a failure
+                continue
+            batch, vectors = item
+            try:
+                if created is None and cname not in client.list_collections():
+                    created = milvuslitebible.create_collection(collection_name=cname, database_name=dbname, embeddings=vectors, metric=codec.metric, partitions=versions)
+                    print(f'Collection {cname} does not exist. Created collection {cname}.')
+                insert_batch(created or client, batch, vectors)
+                # Only record verses once Milvus has them, so a crash re-embeds at most the batches in flight
+                checkpoint.write(''.join(f'{verse[0]}\t{verse[3]}\n' for verse in batch))
+                checkpoint.flush()
+                progress.append(len(batch))
+            except Exception as e:
+                # An exception ending this thread would leave the embedding loop blocked on the full queue
+                errors.append(e)
+    finally:
+        if created is not None:
+            created.close()
+
+
+def run():
+    start = time.perf_counter()
+    codec = vectorcodec.VectorCodec.from_mode(compression)
+    if codec.dtype == np.float16:
+        # Milvus Lite cannot create FLOAT16_VECTOR fields; half precision is stored by the NumPy export instead
+        print(f'VECTOR_COMPRESSION={compression} asks for fp16, which Milvus Lite cannot store. Drop fp16 here and run `python numpyindex.py --dtype float16` after filling the collection.')
+        return
+    client = milvuslitebible.open_client(f'./{dbname}.db')
+    stored = vectorcodec.VectorCodec.load(cname)
+    if cname in client.list_collections():
+        stored_mode = stored.mode if stored is not None else 'none'
+        if stored_mode != codec.mode:
+            print(f'{cname} holds {stored_mode} vectors but {codec.mode} was requested. Rebuilding it.')
+            milvuslitebible.drop_collection(client, cname)
+        elif stored is not None:
+            # Keeps the fitted projection, so resumed and incremental runs encode exactly like the first
+            codec = stored
+    if cname in client.list_collections():
+        done = load_checkpoint(checkpoint_path)
+        # Versions added since the collection was created get their partition here
+        for version in versions:
+            if not client.has_partition(collection_name=cname, partition_name=version):
+                client.create_partition(collection_name=cname, partition_name=version)
+    else:
+        # A missing collection makes any old checkpoint meaningless
+        done = {}
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    verses = []
+    seen = set()
+    for verse_row, version, verse_id, title, text in iter_verses(versions):
+        seen.add(verse_row)
+        digest = text_hash(title, text)
+        if done.get(verse_row) != digest:
+            verses.append((verse_row, title, text, digest, version, verse_id))
+    removed = [verse_row for verse_row in done if verse_row not in seen]
+    print(f'{len(seen)} verses in {", ".join(versions)}: {len(verses)} to embed, {len(seen) - len(verses)} unchanged, {len(removed)} removed.')
+    if codec.needs_fit:
+        fit_codec(codec, verses)
+    codec.save(cname)
+
+    with open(checkpoint_path, 'a') as checkpoint:
+        if removed:
+            client.delete(collection_name=cname, ids=removed)
+            checkpoint.write(''.join(f'{verse_id}\t-\n' for verse_id in removed))
+            checkpoint.flush()
+
+        if verses:
+            batches = plan_batches(verses, batch_size)
+            tokenized = queue.Queue(maxsize=queue_size)
+            embedded = queue.Queue(maxsize=queue_size)
+            progress = []
+            errors = []
+
+            # Tokenizing the next batch and inserting the previous one overlap with the forward pass
+            tokenizer_thread = threading.Thread(target=tokenize_stage, args=(batches, tokenized, errors), daemon=True)
+            inserter_thread = threading.Thread(target=insert_stage, args=(client, codec, embedded, checkpoint, progress, errors), daemon=True)
+            tokenizer_thread.start()
+            inserter_thread.start()
+
+            embed_start = time.perf_counter()
+            reported = 0
+            while True:
+                item = tokenized.get()
+                if item is None:
+                    break
+                batch, inp = item
+                if not errors:
+                    try:
+                        embedded.put((batch, codec.encode(embedding.embed_tokens(inp, mode='sentence'))))
+                    except Exception as e:
+                        errors.append(e)
+                inserted = sum(progress)
+                if inserted - reported >= 2000:
+                    reported = inserted
+                    print(f'Inserted {inserted}/{len(verses)} verses ({inserted / (time.perf_counter() - embed_start):.1f} verses/sec)')
+            embedded.put(None)
+            tokenizer_thread.join()
+            inserter_thread.join()
+
+            if errors:
+                print(f'Ingestion stopped after {sum(progress)} verses: {errors[0]}')
+                print('Run fill_milvus_lite.py again to resume from the checkpoint.')
+                return
+
+            elapsed = time.perf_counter() - embed_start
+            print(f'Embedded and inserted {sum(progress)} verses in {elapsed:.1f}s ({sum(progress) / elapsed:.1f} verses/sec)')
+
+    if verses or removed:
+        milvuslitebible.invalidate_cache(dbname)
+    print(f'Total wall time {time.perf_counter() - start:.1f}s')
+
     print(client.list_collections())
-    client = milvuslitebible.get_database(dbname)
-    print(milvuslitebible.search_collection(query='In the beginning God created the heavens and the earth.', client=client, collection_name=cname, metric='L2'))
+    print(milvuslitebible.search_collection(query='In the beginning God created the heavens and the earth.', client=client, collection_name=cname, metric=codec.metric, partition=versions[0], codec=codec))
     client.close()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,55 @@
+import os
+import secrets
+import signal
+import subprocess
+import sys
+
+# Production server: `gunicorn -c gunicorn.conf.py`. `kill -HUP $(cat gunicorn.pid)` replaces the workers gracefully
+# and reopens the vector index; TERM lets in-flight requests finish, then stops everything.
+wsgi_app = 'main:app'
+bind = os.environ.get('BIND', '0.0.0.0:25565')
+# Every worker has its own generation scheduler, session store and completion memory tier, so prefer threads to workers
+workers = int(os.environ.get('WEB_WORKERS', '2'))
+# A streamed answer holds its thread until the last token is sent
+threads = int(os.environ.get('WEB_THREADS', '8'))
+worker_class = 'gthread'
+# Long enough for a blocking quiz or summary generation
+timeout = 180
+# Time in-flight requests get to finish on HUP or TERM before the worker is killed
+graceful_timeout = 60
+keepalive = 5
+# The app is imported after fork: warm-up and scheduler threads started at import would not survive a fork, and
+# CPython reference counting writes to shared pages anyway. Memory is shared through the vector service instead.
+preload_app = False
+pidfile = 'gunicorn.pid'
+
+# Workers inherit this; VECTOR_SERVICE= (empty) loads the model and the index in every worker instead
+os.environ.setdefault('VECTOR_SERVICE', 'vectorservice.sock')
+# A fresh secret per master start, inherited by the service and the workers; HUP keeps it, a restart replaces it
+os.environ.setdefault('VECTOR_SERVICE_KEY', secrets.token_hex(32))
+service = None
+
+
+def start_service(server):
+    global service
+    if os.environ['VECTOR_SERVICE'] and (service is None or service.poll() is not None):
+        service = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vectorservice.py'), '--address', os.environ['VECTOR_SERVICE']])
+        server.log.info(f'Started vector service (pid {service.pid}) on {os.environ["VECTOR_SERVICE"]}')
+
+
+def on_starting(server):
+    start_service(server)
+
+
+def on_reload(server):
+    # Restarts the service if it died, otherwise asks it to reopen the index
+    if service is not None and service.poll() is None:
+        service.send_signal(signal.SIGHUP)
+    else:
+        start_service(server)
+
+
+def on_exit(server):
+    if service is not None and service.poll() is None:
+        service.terminate()
+        service.wait(timeout=graceful_timeout)
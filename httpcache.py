@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+import lrucache
+from flask import Response, request
+
+try:
+    # Optional; without it clients are offered gzip only
+    import brotli
+except ImportError:
+    brotli = None
+
+# Chapter text never changes for a URL, so browsers may reuse a page this long before revalidating with its ETag
+max_age = 24 * 60 * 60
+# Bodies smaller than this are not worth compressing
+min_compress_bytes = 1024
+
+# Rendered bodies with every precompressed variant, keyed on ETag
+bodies = lrucache.LRUCache(max_entries=4096, max_bytes=128 * 1024 * 1024, sizeof=lambda variants: sum(len(body) for body in variants.values()))
+
+
+def make_etag(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:32]
+
+
+def file_version(path):
+    with open(path, 'rb') as f:
+        return make_etag(f.read())
+
+
+def compress(body):
+    # Compressed once at the highest levels, since every later request for this ETag reuses the result
+    variants = {'identity': body}
+    if len(body) >= min_compress_bytes:
+        variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=11)
+    return variants
+
+
+def choose_encoding(variants):
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and accepted[encoding]:
+            return encoding
+    return 'identity'
+
+
+def variant_etag(etag, encoding):
+    # Each content coding is a different representation, so it gets its own strong ETag
+    return etag if encoding == 'identity' else f'{etag}-{encoding}'
+
+
+def cached_response(etag, build, mimetype):
+    # `build` is only called when neither the browser nor this process has the body for `etag`
+    headers = {'Cache-Control': f'public, max-age={max_age}', 'Vary': 'Accept-Encoding'}
+    for encoding in ('identity', 'gzip', 'br'):
+        if request.if_none_match.contains(variant_etag(etag, encoding)):
+            response = Response(status=304, headers=headers)
+            response.set_etag(variant_etag(etag, encoding))
+            return response
+
+    variants = bodies.get(etag)
+    if variants is None:
+        body = build()
+        variants = compress(body.encode('utf-8') if isinstance(body, str) else body)
+        bodies.put(etag, variants)
+
+    encoding = choose_encoding(variants)
+    response = Response(variants[encoding], mimetype=mimetype, headers=headers)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(variant_etag(etag, encoding))
+    return response
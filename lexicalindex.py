@@ -0,0 +1,208 @@
+import argparse
+import chapterstore
+import json
+import numpy as np
+import os
+import re
+import threading
+
+token_pattern = re.compile(r"[a-z0-9]+")
+# Standard BM25 parameters
+k1 = 1.2
+b = 0.75
+# Reciprocal-rank fusion constant
+rrf_k = 60
+
+
+def tokenize(text):
+    return token_pattern.findall(text.lower())
+
+
+def index_paths(prefix):
+    return {
+        'vocabulary': f'{prefix}.vocabulary.json',
+        'documents': f'{prefix}.documents.npy',
+        'frequencies': f'{prefix}.frequencies.npy',
+        'position_offsets': f'{prefix}.position_offsets.npy',
+        'positions': f'{prefix}.positions.npy',
+        'lengths': f'{prefix}.lengths.npy',
+        'offsets': f'{prefix}.offsets.npy',
+        'text': f'{prefix}.text.bin',
+    }
+
+
+def iter_verses(version, directory=chapterstore.data_dir):
+    for book, chapter, verse, text in chapterstore.iter_verse_texts(version, chapterstore.in_order, directory):
+        yield f'{book} {chapter}:{verse}', text
+
+
+def build_index(prefix, verses):
+    # Postings are laid out term by term in flat arrays so the whole index can be memory-mapped
+    postings = {}
+    lengths = []
+    blob = bytearray()
+    offsets = []
+    for doc, (title, text) in enumerate(verses):
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        for position, token in enumerate(tokens):
+            postings.setdefault(token, {}).setdefault(doc, []).append(position)
+        start = len(blob)
+        blob += title.encode('utf-8')
+        title_end = len(blob)
+        blob += text.encode('utf-8')
+        offsets.append((start, title_end, len(blob)))
+
+    vocabulary = {}
+    documents = []
+    frequencies = []
+    position_offsets = [0]
+    positions = []
+    for term in sorted(postings):
+        vocabulary[term] = [len(documents), len(documents) + len(postings[term])]
+        for doc in sorted(postings[term]):
+            documents.append(doc)
+            frequencies.append(len(postings[term][doc]))
+            positions += postings[term][doc]
+            position_offsets.append(len(positions))
+
+    paths = index_paths(prefix)
+    with open(paths['vocabulary'], 'w') as f:
+        json.dump(vocabulary, f)
+    np.save(paths['documents'], np.asarray(documents, dtype=np.int32))
+    np.save(paths['frequencies'], np.asarray(frequencies, dtype=np.uint16))
+    np.save(paths['position_offsets'], np.asarray(position_offsets, dtype=np.int64))
+    np.save(paths['positions'], np.asarray(positions, dtype=np.uint16))
+    np.save(paths['lengths'], np.asarray(lengths, dtype=np.uint16))
+    np.save(paths['offsets'], np.asarray(offsets, dtype=np.int64))
+    with open(paths['text'], 'wb') as f:
+        f.write(bytes(blob))
+    print(f'Indexed {len(lengths)} verses and {len(vocabulary)} terms into {prefix}')
+
+
+class LexicalIndex:
+    # BM25 and exact-phrase search over a prebuilt, memory-mapped inverted index
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.paths = index_paths(prefix)
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.paths['vocabulary'])
+
+    def load(self):
+        with self.lock:
+            if not self.loaded:
+                with open(self.paths['vocabulary'], 'r') as f:
+                    self.vocabulary = json.load(f)
+                for name in ('documents', 'frequencies', 'position_offsets', 'positions', 'lengths', 'offsets'):
+                    setattr(self, name, np.load(self.paths[name], mmap_mode='r'))
+                with open(self.paths['text'], 'rb') as f:
+                    self.blob = f.read()
+                self.average_length = float(np.mean(self.lengths))
+                self.loaded = True
+
+    def hit(self, doc, score):
+        start, title_end, text_end = self.offsets[doc]
+        return {'title': self.blob[start:title_end].decode('utf-8'), 'text': self.blob[title_end:text_end].decode('utf-8'), 'score': float(score)}
+
+    def scores(self, terms):
+        scores = np.zeros(len(self.lengths), dtype=np.float32)
+        for term in set(terms):
+            if term not in self.vocabulary:
+                continue
+            start, end = self.vocabulary[term]
+            documents = np.asarray(self.documents[start:end])
+            frequencies = np.asarray(self.frequencies[start:end], dtype=np.float32)
+            idf = np.log(1 + (len(self.lengths) - len(documents) + 0.5) / (len(documents) + 0.5))
+            lengths = np.asarray(self.lengths[documents], dtype=np.float32)
+            scores[documents] += idf * frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * lengths / self.average_length))
+        return scores
+
+    def top(self, documents, scores, k):
+        # Highest scores first; ties keep canonical order
+        k = min(k, len(documents))
+        if not k:
+            return []
+        top = documents[np.argpartition(-scores[documents], k - 1)[:k]]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [self.hit(int(doc), scores[doc]) for doc in top]
+
+    def bm25(self, query, k=5):
+        self.load()
+        scores = self.scores(tokenize(query))
+        return self.top(np.flatnonzero(scores), scores, k)
+
+    def phrase_documents(self, terms):
+        # Every verse containing the terms consecutively, in canonical order
+        if not terms or any(term not in self.vocabulary for term in terms):
+            return np.zeros(0, dtype=np.int64)
+        postings = []
+        for term in terms:
+            start, end = self.vocabulary[term]
+            postings.append((start, np.asarray(self.documents[start:end])))
+        candidates = postings[0][1]
+        for _, documents in postings[1:]:
+            candidates = np.intersect1d(candidates, documents, assume_unique=True)
+        if len(postings) == 1:
+            return candidates.astype(np.int64)
+        matches = []
+        for doc in candidates:
+            starts = None
+            for offset, (start, documents) in enumerate(postings):
+                posting = start + int(np.searchsorted(documents, doc))
+                positions = set(int(position) - offset for position in self.positions[self.position_offsets[posting]:self.position_offsets[posting + 1]])
+                starts = positions if starts is None else starts & positions
+                if not starts:
+                    break
+            if starts:
+                matches.append(int(doc))
+        return np.asarray(matches, dtype=np.int64)
+
+    def phrase(self, query, k=5):
+        # Returns the k exact matches with the best BM25 score and the number of verses that match
+        self.load()
+        terms = tokenize(query)
+        documents = self.phrase_documents(terms)
+        if not len(documents):
+            return [], 0
+        return self.top(documents, self.scores(terms), k), len(documents)
+
+
+def fuse(*rankings, k=5):
+    # Reciprocal-rank fusion keyed on verse title
+    scores = {}
+    hits = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking):
+            scores[hit['title']] = scores.get(hit['title'], 0.0) + 1.0 / (rrf_k + rank + 1)
+            hits.setdefault(hit['title'], hit)
+    ordered = sorted(scores, key=lambda title: (-scores[title], title))
+    return [hits[title] for title in ordered[:k]]
+
+
+def hybrid_search(index, retriever, query, k=5, max_lexical_terms=3, version=None):
+    # A short, selective query (a name, a rare word) is answered by its exact occurrences without an embedding
+    # forward pass; common words match too many verses for that, so they are fused with BM25 and vector search.
+    # `index` should be built from the same version that `version` restricts the vector search to
+    if index is None or not index.exists():
+        return retriever.search(query, k, version)
+    terms = tokenize(query)
+    phrase_hits, matches = index.phrase(query, k)
+    if 0 < matches <= k and len(terms) <= max_lexical_terms:
+        return phrase_hits
+    # For a single word the phrase ranking is the BM25 ranking; fusing both would count it twice
+    lexical = [phrase_hits] if len(terms) == 1 else [phrase_hits, index.bm25(query, k)]
+    return fuse(*lexical, retriever.search(query, k, version), k=k)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a BM25 / exact-phrase inverted index over the verse text of each version.')
+    parser.add_argument('--versions', nargs='+', default=chapterstore.version_selection)
+    parser.add_argument('--prefix', default='milvuslitebible_bible')
+    parser.add_argument('--data-dir', default=chapterstore.data_dir)
+    args = parser.parse_args()
+
+    for version in args.versions:
+        build_index(f'{args.prefix}.{version}.lexical', iter_verses(version, args.data_dir))
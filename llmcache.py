@@ -0,0 +1,96 @@
+import hashlib
+import json
+import lrucache
+import sqlite3
+import threading
+import time
+
+
+class CompletionCache:
+    # Content-addressed store of LLM completions: SQLite on disk with a small in-memory tier in front
+    def __init__(self, path='llmcache.db', ttl=30 * 24 * 60 * 60, max_bytes=256 * 1024 * 1024, memory_entries=1024, memory_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory = lrucache.LRUCache(max_entries=memory_entries, max_bytes=memory_bytes, sizeof=lambda entry: len(entry[0]))
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, accessed REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)')
+        self.connection.commit()
+        self.total_bytes = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM completions').fetchone()[0]
+
+    @staticmethod
+    def key(model, prompt, options=None):
+        payload = json.dumps({'model': model, 'prompt': prompt, 'options': options or {}}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, model, prompt, options=None):
+        key = self.key(model, prompt, options)
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        with self.lock:
+            row = self.connection.execute('SELECT response, created FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if created + self.ttl <= now:
+                self.delete_key(key)
+                self.connection.commit()
+                return None
+            self.connection.execute('UPDATE completions SET accessed = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+        self.memory.put(key, (response, created + self.ttl))
+        return response
+
+    def put(self, model, prompt, response, options=None):
+        key = self.key(model, prompt, options)
+        now = time.time()
+        size = len(response.encode('utf-8')) + len(key)
+        with self.lock:
+            self.delete_key(key)
+            self.connection.execute('INSERT INTO completions (key, model, response, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)', (key, model, response, size, now, now))
+            self.total_bytes += size
+            self.evict(now)
+            self.connection.commit()
+        self.memory.put(key, (response, now + self.ttl))
+
+    def delete_key(self, key):
+        row = self.connection.execute('SELECT size FROM completions WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self.connection.execute('DELETE FROM completions WHERE key = ?', (key,))
+            self.total_bytes -= row[0]
+
+    def evict(self, now):
+        # Drop expired entries first, then the least recently used until under the size limit
+        expired = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM completions WHERE created <= ?', (now - self.ttl,)).fetchone()[0]
+        if expired:
+            self.connection.execute('DELETE FROM completions WHERE created <= ?', (now - self.ttl,))
+            self.total_bytes -= expired
+        if self.total_bytes > self.max_bytes:
+            evicted = []
+            for key, size in self.connection.execute('SELECT key, size FROM completions ORDER BY accessed').fetchall():
+                if self.total_bytes <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                self.total_bytes -= size
+            self.connection.executemany('DELETE FROM completions WHERE key = ?', evicted)
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM completions')
+            self.connection.commit()
+            self.total_bytes = 0
+        self.memory.clear()
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+            return {'entries': entries, 'bytes': self.total_bytes, 'memory': self.memory.stats()}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
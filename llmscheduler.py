@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import json
+import metrics
+import ollama
+import threading
+import time
+from concurrent.futures import Future
+
+# Lower numbers are served first when requests are waiting for the same model
+INTERACTIVE = 0
+QUESTION = 1
+BATCH = 2
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+class ModelQueue:
+    def __init__(self, concurrency, max_queue_depth):
+        self.concurrency = concurrency
+        self.max_queue_depth = max_queue_depth
+        self.active = 0
+        self.waiting = []
+        self.condition = threading.Condition()
+        self.served = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.max_depth_seen = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, priority, sequence):
+        start = time.monotonic()
+        with self.condition:
+            if self.active >= self.concurrency and len(self.waiting) >= self.max_queue_depth:
+                self.rejected += 1
+                raise SchedulerBusy('Too many requests are waiting for the model. Please try again shortly.')
+            entry = (priority, sequence)
+            heapq.heappush(self.waiting, entry)
+            self.max_depth_seen = max(self.max_depth_seen, len(self.waiting))
+            while self.active >= self.concurrency or self.waiting[0] != entry:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.active += 1
+            wait = time.monotonic() - start
+            self.served += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            # Let the next waiter re-check in case more than one slot is free
+            self.condition.notify_all()
+            return wait
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'concurrency': self.concurrency,
+                'active': self.active,
+                'queue_depth': len(self.waiting),
+                'max_queue_depth_seen': self.max_depth_seen,
+                'served': self.served,
+                'rejected': self.rejected,
+                'coalesced': self.coalesced,
+                'average_wait': self.total_wait / self.served if self.served else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+
+class SharedGeneration:
+    # One upstream Ollama stream read on its own thread; every subscriber replays the chunks from the start
+    def __init__(self, scheduler, key, model, prompt, options):
+        self.scheduler = scheduler
+        self.key = key
+        self.model = model
+        self.prompt = prompt
+        self.options = options
+        # The reader thread reports prefill and generation under the route of the request that started it
+        self.route = metrics.route()
+        self.received = []
+        self.subscribers = 0
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def subscribe(self):
+        with self.condition:
+            if self.cancelled:
+                return None
+            self.subscribers += 1
+            return GenerationStream(self)
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+            cancel = self.subscribers == 0 and not self.done
+            if cancel:
+                # Nobody is listening any more; the reader thread drops the upstream connection at the next chunk
+                self.cancelled = True
+        if cancel:
+            self.scheduler.finish_stream(self)
+
+    def fail(self, error):
+        with self.condition:
+            self.error = error
+            self.done = True
+            self.condition.notify_all()
+        self.scheduler.finish_stream(self)
+
+    def start(self):
+        threading.Thread(target=self.run, name=f'stream-{self.model}', daemon=True).start()
+
+    def run(self):
+        metrics.current.route = self.route
+        chunks = None
+        try:
+            with self.condition:
+                if self.cancelled:
+                    # Every subscriber left while the request was still queued
+                    return
+            chunks = ollama.generate(model=self.model, prompt=self.prompt, keep_alive=-1, stream=True, **self.options)
+            for chunk in chunks:
+                if chunk.get('done'):
+                    metrics.observe_generation(self.model, chunk)
+                with self.condition:
+                    if self.cancelled:
+                        break
+                    self.received.append(chunk)
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+        finally:
+            if chunks is not None:
+                # Dropping the HTTP connection makes Ollama abort the generation
+                chunks.close()
+            self.scheduler.queue(self.model).release()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+            self.scheduler.finish_stream(self)
+
+    def chunk(self, index):
+        # Blocks until chunk `index` exists; None once the generation has ended before it
+        with self.condition:
+            while index >= len(self.received) and not self.done:
+                self.condition.wait()
+            if index < len(self.received):
+                return self.received[index]
+            if self.error is not None:
+                raise self.error
+            return None
+
+
+class GenerationStream:
+    # One subscriber of a shared generation; the model slot is freed once the generation ends or every subscriber closed
+    def __init__(self, shared):
+        self.shared = shared
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            index = 0
+            while not self.closed:
+                chunk = self.shared.chunk(index)
+                if chunk is None:
+                    return
+                index += 1
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.shared.unsubscribe()
+
+
+class GenerationScheduler:
+    # Central gate in front of Ollama: per-model concurrency, priorities, bounded queues and coalescing
+    def __init__(self, concurrency=None, default_concurrency=1, max_queue_depth=16, model_options=None):
+        self.concurrency = concurrency or {}
+        # Ollama `options` sent with every request to a model, e.g. {'num_ctx': 4096}
+        self.model_options = model_options or {}
+        self.default_concurrency = default_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.queues = {}
+        self.in_flight = {}
+        self.in_flight_streams = {}
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+
+    def queue(self, model):
+        with self.lock:
+            if model not in self.queues:
+                self.queues[model] = ModelQueue(self.concurrency.get(model, self.default_concurrency), self.max_queue_depth)
+            return self.queues[model]
+
+    def with_model_options(self, model, options):
+        if model not in self.model_options:
+            return options
+        return {**options, 'options': {**self.model_options[model], **options.get('options', {})}}
+
+    def generate(self, model, prompt, priority=INTERACTIVE, **options):
+        # Identical prompts that are already generating share the same result instead of running twice
+        options = self.with_model_options(model, options)
+        key = (model, prompt, json.dumps(options, sort_keys=True))
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+        if not owner:
+            model_queue = self.queue(model)
+            with model_queue.condition:
+                model_queue.coalesced += 1
+            return future.result()
+
+        model_queue = self.queue(model)
+        try:
+            metrics.observe('queue_wait', model_queue.acquire(priority, next(self.sequence)))
+            try:
+                response = ollama.generate(model=model, prompt=prompt, keep_alive=-1, **options)
+            finally:
+                model_queue.release()
+            metrics.observe_generation(model, response)
+            future.set_result(response)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+        return response
+
+    def stream(self, model, prompt, priority=INTERACTIVE, **options):
+        # Identical prompts that are already streaming join that stream instead of taking another slot
+        options = self.with_model_options(model, options)
+        key = (model, prompt, json.dumps(options, sort_keys=True))
+        model_queue = self.queue(model)
+        with self.lock:
+            shared = self.in_flight_streams.get(key)
+            subscriber = shared.subscribe() if shared is not None else None
+            if subscriber is None:
+                shared = SharedGeneration(self, key, model, prompt, options)
+                self.in_flight_streams[key] = shared
+                subscriber = shared.subscribe()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            with model_queue.condition:
+                model_queue.coalesced += 1
+            return subscriber
+
+        # Waits for a slot before returning so a full queue can still be rejected with a 503
+        try:
+            metrics.observe('queue_wait', model_queue.acquire(priority, next(self.sequence)))
+        except BaseException as e:
+            shared.fail(e)
+            raise
+        shared.start()
+        return subscriber
+
+    def finish_stream(self, shared):
+        with self.lock:
+            if self.in_flight_streams.get(shared.key) is shared:
+                del self.in_flight_streams[shared.key]
+
+    def stats(self):
+        with self.lock:
+            queues = dict(self.queues)
+        return {model: model_queue.stats() for model, model_queue in queues.items()}
@@ -1,86 +1,294 @@
+import startup
+import artifacts
 import bs4bible
-from flask import Flask, render_template, request, redirect, jsonify
+import chapterstore
+import contextbuilder
+import conversations
+import debuglog
+import dictionary
+import embedding
+import httpcache
+from flask import Flask, Response, g, render_template, request, redirect, jsonify, stream_with_context
 import json
-import milvuslitebible
-import nltk
-from nltk.corpus import wordnet2022
+import lexicalindex
+import llmcache
+import llmscheduler
+import metrics
 import ollama
 import os
+import prompts
 import string
 import time
+import vectorservice
+import warmup
 import ast
 
-nltk.download('wordnet2022')
+startup.mark('imports')
 
 app = Flask(__name__)
 model = "qwen2.5:1.5b"
 quiz_model = "qwen2.5-coder:3b"
 dbname = 'milvuslitebible'
-cname = 'milvuslitebible_nasb1995'
+# Built with `python fill_milvus_lite.py`: one collection with a partition per version
+cname = 'milvuslitebible_bible'
 default_version = 'nasb'
+# VECTOR_SERVICE=<socket> sends embedding and vector search to the one process started by `python vectorservice.py`,
+# so web workers never load the embedding model or open the index themselves
+if vectorservice.address:
+    retriever = vectorservice.RemoteRetriever(vectorservice.address)
+else:
+    retriever = vectorservice.local_retriever(dbname, cname)
+# Built with `python lexicalindex.py`; define falls back to vector search alone when a version has none
+lexical_indexes = {version: lexicalindex.LexicalIndex(f'{cname}.{version}.lexical') for version in chapterstore.version_selection}
+# Context window of the chat model, sent with every request to it: Ollama reloads a model whose num_ctx changes,
+# and its default window can be smaller than a conversation about a long chapter
+context_window = 4096
+# Concurrent generations allowed per model before requests queue by priority
+scheduler = llmscheduler.GenerationScheduler(concurrency={model: 2, quiz_model: 1}, max_queue_depth=16, model_options={model: {'num_ctx': context_window}})
+# Completions are reused for identical model + prompt; set a route to False to always generate fresh
+completion_cache = llmcache.CompletionCache('llmcache.db')
+# Built offline with `python precompute.py`
+artifact_store = artifacts.ArtifactStore('artifacts.db')
+# Readers who send a session_id keep one Ollama context per chapter from their second question on;
+# max_context_tokens leaves a quarter of the context window for the next question and its answer
+sessions = conversations.SessionStore(max_sessions=64, idle_timeout=15 * 60, max_context_tokens=context_window * 3 // 4)
+cache_routes = {
+    'explain_selection': True,
+    'define_selection': True,
+    'ask_question': True,
+    'ask_selection': True,
+    'get_quiz': True,
+    'summarize_chapter': True,
+}
+startup.mark('caches')
+
+in_order = chapterstore.in_order
+version_selection = chapterstore.version_selection
+
+# Manifest and pack are built with `python chapterstore.py`
+manifest_path = 'manifest.json'
+if os.path.exists(manifest_path):
+    selection = chapterstore.load_manifest(manifest_path)
+else:
+    print(f'{manifest_path} not found. Counting chapters from the data directory instead.')
+    selection = chapterstore.count_chapters(in_order, default_version)
+startup.mark('manifest')
+
+# Without the pack, chapters are rendered from the JSON tree on first view
+chapter_pack = 'chapters.pack'
+chapters = chapterstore.ChapterStore(version_selection, in_order, pack_path=chapter_pack if os.path.exists(chapter_pack) else None)
+# Part of every page ETag, so editing the template or the chapter list changes every page's ETag
+page_version = httpcache.make_etag(httpcache.file_version(os.path.join(app.root_path, 'templates', 'index.html')), json.dumps(selection, sort_keys=True), *version_selection)
+startup.mark('chapter store')
+
+# Built with `python dictionary.py`; WordNet itself is only loaded for words missing from the table
+dictionary.load()
+startup.mark('dictionary')
+
+
+def warm_model(model_name):
+    # An empty prompt loads the model into memory and keep_alive=-1 keeps it there
+    ollama.generate(model=model_name, prompt='', keep_alive=-1, **scheduler.with_model_options(model_name, {}))
+
+
+def warm_embedding():
+    # Loads the model and runs one forward pass so the first real query is not the slow one
+    embedding.get_embedding('warm up', mode='query')
+
+
+# Components load concurrently in the background; /readyz reports 503 until all of them are warm
+warmer = warmup.WarmupManager()
+warmer.add(model, warm_model, model)
+warmer.add(quiz_model, warm_model, quiz_model)
+if not vectorservice.address:
+    warmer.add('embedding', warm_embedding)
+warmer.add('vector index', retriever.connect)
+warmer.add('context tokenizer', contextbuilder.load_tokenizer)
+warmer.start()
+
+
+@app.before_request
+def start_request():
+    g.started = time.perf_counter()
+    metrics.current.route = request.endpoint
+    debuglog.begin()
+
+
+@app.after_request
+def finish_request(response):
+    # Streamed responses only finish once the last token is sent, so the duration is taken when the response closes
+    started = g.started
+    route = request.endpoint or 'none'
+    status = str(response.status_code)
+    response.call_on_close(lambda: metrics.request_seconds.observe(time.perf_counter() - started, route, status))
+    return response
+
+
+@metrics.timed('parse')
+def request_json():
+    return request.get_json()
 
-with open("NASB1995_bible.json", "r", encoding='utf-8-sig') as file:
-    bible_json = json.load(file)
 
-client = ollama.generate(model="qwen2.5:1.5b", prompt="", keep_alive=-1)
+def get_word_info(word):
+    word_info = dictionary.get_word_info(word)
+    if word_info:
+        debuglog.log('definition', word_info[0])
+        debuglog.log('synonyms', word_info[1])
+    return word_info
+
+
+def generate_text(model_name, prompt, priority, route, cacheable=None):
+    # Summaries and quizzes precomputed by precompute.py are served before anything is generated
+    response = artifact_store.get(model_name, prompt)
+    if response is not None:
+        return response
+    use_cache = cache_routes.get(route, False)
+    if use_cache:
+        response = completion_cache.get(model_name, prompt)
+        if response is not None:
+            return response
+    response = scheduler.generate(model_name, prompt, priority)["response"]
+    if use_cache and (cacheable is None or cacheable(response)):
+        completion_cache.put(model_name, prompt, response)
+    return response
+
+
+def stream_generation(model_name, prompt, priority, route):
+    # Relay tokens to the browser as Server-Sent Events as soon as Ollama produces them
+    use_cache = cache_routes.get(route, False)
+    cached = artifact_store.get(model_name, prompt)
+    if cached is None and use_cache:
+        cached = completion_cache.get(model_name, prompt)
+    if cached is not None:
+        return Response(f"data: {json.dumps({'token': cached})}\n\nevent: done\ndata: {{}}\n\n", mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    chunks = scheduler.stream(model_name, prompt, priority)
+
+    def generate():
+        tokens = []
+        try:
+            for chunk in chunks:
+                if chunk['response']:
+                    tokens.append(chunk['response'])
+                    yield f"data: {json.dumps({'token': chunk['response']})}\n\n"
+            # Only completions that ran to the end are worth reusing
+            if use_cache:
+                completion_cache.put(model_name, prompt, ''.join(tokens))
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(e)
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Closing the Ollama stream drops its HTTP connection, which aborts the generation upstream
+    # when the browser cancels, and frees the model slot even if streaming never started
+    response.call_on_close(chunks.close)
+    return response
+
+
+def reader_version(data):
+    # Context verses come from the version on the reader's screen
+    return str(data.get('version', default_version)).strip().lower()
+
+
+def start_turn(data, build_turn):
+    # Returns (session, prompt, options) for a conversation turn, or None to answer with a standalone prompt
+    session_id = data.get('session_id')
+    if not session_id:
+        return None
+    book = str(data.get('book')).strip()
+    chapter = str(data.get('chapter')).strip()
+    version = reader_version(data)
+    verses = chapters.get(book, chapter, version)
+    session = sessions.open(str(session_id), (model, version, book, chapter), lambda: prompts.conversation_prefix(book, chapter, prompts.chapter_context(verses)))
+    started = session.begin(lambda: build_turn(data))
+    if started is None:
+        return None
+    return session, started[0], started[1]
+
+
+def generate_turn(session, prompt, options, priority):
+    context = None
+    try:
+        result = scheduler.generate(model, prompt, priority, **options)
+        context = result.get('context')
+        return result['response']
+    finally:
+        sessions.finish(session, context)
 
-in_order = [
-    "Genesis", "Exodus", "Leviticus", "Numbers", "Deuteronomy", "Joshua",
-    "Judges", "Ruth", "1 Samuel", "2 Samuel", "1 Kings", "2 Kings",
-    "1 Chronicles", "2 Chronicles", "Ezra", "Nehemiah", "Esther", "Job",
-    "Psalm", "Proverbs", "Ecclesiastes", "Song of Solomon", "Isaiah",
-    "Jeremiah", "Lamentations", "Ezekiel", "Daniel", "Hosea", "Joel",
-    "Amos", "Obadiah", "Jonah", "Micah", "Nahum", "Habakkuk", "Zephaniah",
-    "Haggai", "Zechariah", "Malachi", "Matthew", "Mark", "Luke", "John",
-    "Acts", "Romans", "1 Corinthians", "2 Corinthians", "Galatians",
-    "Ephesians", "Philippians", "Colossians", "1 Thessalonians",
-    "2 Thessalonians", "1 Timothy", "2 Timothy", "Titus", "Philemon",
-    "Hebrews", "James", "1 Peter", "2 Peter", "1 John", "2 John",
-    "3 John", "Jude", "Revelation"
-]
 
-selection = {}
-for book_title in in_order:
-    selection[book_title] = len(os.listdir(f'bible-data/data/{default_version}/books/{book_title}/chapters'))
+def stream_turn(session, prompt, options, priority):
+    # Same events as stream_generation; the final chunk carries the context for the next turn
+    try:
+        chunks = scheduler.stream(model, prompt, priority, **options)
+    except BaseException:
+        sessions.finish(session, None)
+        raise
+    state = {'context': None}
 
-version_selection = ['csb', 'esv', 'kjv', 'nasb', 'niv', 'nkjv']
+    def generate():
+        try:
+            for chunk in chunks:
+                if chunk['response']:
+                    yield f"data: {json.dumps({'token': chunk['response']})}\n\n"
+                if chunk.get('context'):
+                    state['context'] = chunk.get('context')
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(e)
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
 
+    def close():
+        chunks.close()
+        sessions.finish(session, state['context'])
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(close)
+    return response
+
+
+@app.errorhandler(chapterstore.ChapterNotFound)
+def chapter_not_found(e):
+    return jsonify(error=str(e.args[0])), 404
 
-def get_word_info(word):
-    synsets = wordnet2022.synsets(word)
-    if not synsets:
-        return None
-    synset = synsets[0]
-    definition = synset.definition()
-    synonyms = synset.lemma_names()
-    for pointer in range(len(synonyms)):
-        synonyms[pointer] = str(synonyms[pointer]).replace('_', ' ')
-    print(definition)
-    print(synonyms)
-    return definition, synonyms
 
+@app.errorhandler(prompts.BadVerseRange)
+def bad_verse_range(e):
+    return jsonify(error=str(e)), 400
 
-def parse_text(text):
-    words = text.split()
-    parsed_words = []
 
-    for word in words:
-        # Check if the word contains '*', indicating it has attributes
-        if '*' in word:
-            base_word, attributes = word.split('*', 1)
+@app.errorhandler(llmscheduler.SchedulerBusy)
+def scheduler_busy(e):
+    return jsonify(error=str(e)), 503
 
-            # If 'r' is in the attributes, wrap the base word in a span
-            if 'r' in attributes:
-                parsed_word = f'<span style="color:red;">{base_word}</span>'
-            else:
-                parsed_word = base_word  # Ignore other attributes
-        else:
-            parsed_word = word  # Word without attributes
 
-        parsed_words.append(parsed_word)
+@app.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
 
-    # Join parsed words back into a single string
-    return ' '.join(parsed_words)
+
+@app.route('/readyz')
+def readyz():
+    ready = warmer.ready()
+    return jsonify(ready=ready, components=warmer.status()), 200 if ready else 503
+
+
+@app.route('/scheduler-stats')
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+
+@app.route('/cache-stats')
+def cache_stats():
+    stats = {'completions': completion_cache.stats(), 'artifacts': artifact_store.stats(), 'sessions': sessions.stats()}
+    if vectorservice.address:
+        stats['vector_service'] = retriever.stats()
+    return jsonify(stats)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
@@ -96,27 +304,33 @@ def bible_book_fix(book, chapter):
 @app.route('/<string:book>-<string:chapter>-<string:version>')
 def bible_book(book, chapter, version):
     version = version.lower()
-    print(f'{book}, {chapter}, {version}')
+    debuglog.log('BIBLE_BOOK', f'{book}, {chapter}, {version}')
     try:
-        verses = []
-        with open(f"bible-data/data/{version}/books/{book}/chapters/{chapter}/{chapter}.json", "r") as f:
-            json_file = json.loads(f.read())
-            for verse in json_file:
-                if 'h' in verse and verse['h'] == 2:
-                    verses.append(f'<span style="font-weight: bold;">{verse['t']}</span>')
-                elif 'h' not in verse:
-                    verses.append(f'{verse['r'].split(':')[-1]}) {parse_text(verse['t'])}')
-
-        # verses = list(bible_json[book][chapter].values())
-        return render_template('index.html', verses=verses, book=book, chapter=chapter, version=version, selection=selection, in_order=in_order, version_selection=version_selection)
+        verses = chapters.get(book, chapter, version)
     except Exception as e:
         print(e)
         return redirect(f'/Genesis-1-{default_version}')
 
+    def render():
+        with metrics.span('render'):
+            return render_template('index.html', verses=verses, book=book, chapter=chapter, version=version, selection=selection, in_order=in_order, version_selection=version_selection)
 
-@app.route('/explain-selection', methods=['POST'])
-def explain_selection():
-    data = request.get_json()
+    # A page only changes when its chapter text or the template does, so it is rendered and compressed once
+    etag = httpcache.make_etag(page_version, version, book, chapter, *verses)
+    return httpcache.cached_response(etag, render, 'text/html')
+
+
+@app.route('/chapter/<string:book>-<string:chapter>-<string:version>')
+def chapter_json(book, chapter, version):
+    # Just the verses, for next/previous navigation without reloading the page
+    version = version.lower()
+    verses = chapters.get(book, chapter, version)
+    etag = httpcache.make_etag('chapter-json', version, book, chapter, *verses)
+    return httpcache.cached_response(etag, lambda: json.dumps({'book': book, 'chapter': int(chapter), 'version': version, 'verses': list(verses)}), 'application/json')
+
+
+@metrics.timed('prompt')
+def explain_selection_prompt(data):
     selected_text = str(data.get('selected_text')).strip()
     book = str(data.get('book')).strip()
     chapter = str(data.get('chapter')).strip()
@@ -125,21 +339,15 @@ def explain_selection():
     verse = full_context.split(')')[0]
     full_context = ')'.join(full_context.split(')')[1:]).strip()
 
-    print(full_context)
+    debuglog.log('context', full_context)
 
     # Process the selected text (e.g., save it, log it, etc.)
-    print(f"(EXPLAIN_SELECTION) Received selected text: {selected_text}")
-    milvus_client = milvuslitebible.get_database(dbname)
-    milvus_returns = milvuslitebible.search_collection(query=selected_text, client=milvus_client, collection_name=cname, metric='L2')
-    milvus_client.close()
+    debuglog.log('EXPLAIN_SELECTION', f"Received selected text: {selected_text}")
+    milvus_returns = retriever.search(selected_text, k=contextbuilder.candidates, version=reader_version(data))
+    context_string = contextbuilder.build([milvus_returns], exclude=[contextbuilder.reference(book, chapter, verse)])
 
     prompt = f"""Below is some potential additional context verses that could be helpful for explaining a later verse:
-Context verse 1: \"{milvus_returns[0]['text']}\" - {milvus_returns[0]['title']}
-Context verse 2: \"{milvus_returns[1]['text']}\" - {milvus_returns[1]['title']}
-Context verse 3: \"{milvus_returns[2]['text']}\" - {milvus_returns[2]['title']}
-Context verse 4: \"{milvus_returns[3]['text']}\" - {milvus_returns[3]['title']}
-Context verse 5: \"{milvus_returns[4]['text']}\" - {milvus_returns[4]['title']}
-
+{context_string}
 Below is the full Bible verse context from where \"{selected_text}\" originated:
 \"{full_context}\" - {book} {chapter}:{verse}
 
@@ -154,15 +362,49 @@ Now write your explanation to the phrase using the above context.
 Response:
 """
 
-    print(prompt)
-    response = ollama.generate(model=model, prompt=prompt, keep_alive=-1)["response"]
-    print(response)
+    return prompt
+
+
+@metrics.timed('prompt')
+def explain_selection_turn(data):
+    selected_text = str(data.get('selected_text')).strip()
+    book = str(data.get('book')).strip()
+    chapter = str(data.get('chapter')).strip()
+    verse = str(data.get('full_context')).strip().split(')')[0]
+
+    # The verse itself is already in the chapter text at the start of the conversation
+    debuglog.log('EXPLAIN_SELECTION', f"Received selected text in a conversation: {selected_text}")
+    milvus_returns = retriever.search(selected_text, k=contextbuilder.candidates, version=reader_version(data))
+    context_string = contextbuilder.build([milvus_returns], exclude=[contextbuilder.reference(book, chapter, verse)])
+    return prompts.conversation_turn(f'What does this phrase from {book} {chapter}:{verse} mean?', context_string, selected_text)
+
+
+@app.route('/explain-selection', methods=['POST'])
+def explain_selection():
+    data = request_json()
+    turn = start_turn(data, explain_selection_turn)
+    if turn is not None:
+        return jsonify(message=generate_turn(*turn, llmscheduler.INTERACTIVE))
+    prompt = explain_selection_prompt(data)
+    debuglog.log('prompt', prompt)
+    response = generate_text(model, prompt, llmscheduler.INTERACTIVE, 'explain_selection')
+    debuglog.log('response', response)
     return jsonify(message=response)
 
 
-@app.route('/define-selection', methods=['POST'])
-def define_selection():
-    data = request.get_json()
+@app.route('/explain-selection/stream', methods=['POST'])
+def explain_selection_stream():
+    data = request_json()
+    turn = start_turn(data, explain_selection_turn)
+    if turn is not None:
+        return stream_turn(*turn, llmscheduler.INTERACTIVE)
+    prompt = explain_selection_prompt(data)
+    debuglog.log('prompt', prompt)
+    return stream_generation(model, prompt, llmscheduler.INTERACTIVE, 'explain_selection')
+
+
+@metrics.timed('prompt')
+def define_selection_prompt(data):
     selected_text = str(data.get('selected_text')).strip().translate(str.maketrans('', '', string.punctuation))
     book = str(data.get('book')).strip()
     chapter = str(data.get('chapter')).strip()
@@ -171,20 +413,16 @@ def define_selection():
     verse = full_context.split(')')[0]
     full_context = ')'.join(full_context.split(')')[1:]).strip()
 
-    print(full_context)
+    debuglog.log('context', full_context)
 
-    milvus_client = milvuslitebible.get_database(dbname)
-    milvus_returns = milvuslitebible.search_collection(query=selected_text, client=milvus_client, collection_name=cname, metric='L2')
-    milvus_client.close()
+    # Single words and names are matched exactly first, falling back to fused BM25 + vector hits
+    version = reader_version(data)
+    milvus_returns = lexicalindex.hybrid_search(lexical_indexes.get(version), retriever, selected_text, k=contextbuilder.candidates, version=version)
+    context_string = contextbuilder.build([milvus_returns], exclude=[contextbuilder.reference(book, chapter, verse)])
 
     if len(selected_text.split(' ')) > 1:
         prompt = f"""You will soon define \"{selected_text}\" from the Bible, but before you do that, below are some verses with some potential additional context to provide context clues about what the word or phrase means:
-Context verse 1: \"{milvus_returns[0]['text']}\" - {milvus_returns[0]['title']}
-Context verse 2: \"{milvus_returns[1]['text']}\" - {milvus_returns[1]['title']}
-Context verse 3: \"{milvus_returns[2]['text']}\" - {milvus_returns[2]['title']}
-Context verse 4: \"{milvus_returns[3]['text']}\" - {milvus_returns[3]['title']}
-Context verse 5: \"{milvus_returns[4]['text']}\" - {milvus_returns[4]['title']}
-        
+{context_string}        
 Below is the full Bible verse context from where \"{selected_text}\" originated:
 \"{full_context}\" - {book} {chapter}:{verse}
 
@@ -206,12 +444,7 @@ Definition: {word_info[0]}\n"""
                 dictionary_context += f"""Synonyms: {', '.join(word_info[1])}"""
 
         prompt = f"""You will soon define \"{selected_text}\" from the Bible, but before you do that, below are some verses with some potential additional context to provide context clues about what the word or phrase means:
-Context verse 1: \"{milvus_returns[0]['text']}\" - {milvus_returns[0]['title']}
-Context verse 2: \"{milvus_returns[1]['text']}\" - {milvus_returns[1]['title']}
-Context verse 3: \"{milvus_returns[2]['text']}\" - {milvus_returns[2]['title']}
-Context verse 4: \"{milvus_returns[3]['text']}\" - {milvus_returns[3]['title']}
-Context verse 5: \"{milvus_returns[4]['text']}\" - {milvus_returns[4]['title']}
-
+{context_string}
 Below is the full Bible verse context from where \"{selected_text}\" originated:
 \"{full_context}\" - {book} {chapter}:{verse}
 
@@ -226,31 +459,37 @@ Response:
 """
 
     # Process the selected text (e.g., save it, log it, etc.)
-    print(f"(DEFINE_SELECTION) Received selected text: {selected_text}")
-    print(prompt)
+    debuglog.log('DEFINE_SELECTION', f"Received selected text: {selected_text}")
 
-    response = ollama.generate(model=model, prompt=prompt, keep_alive=-1)["response"]
-    print(response)
+    return prompt
+
+
+@app.route('/define-selection', methods=['POST'])
+def define_selection():
+    prompt = define_selection_prompt(request_json())
+    debuglog.log('prompt', prompt)
+    response = generate_text(model, prompt, llmscheduler.INTERACTIVE, 'define_selection')
+    debuglog.log('response', response)
     return jsonify(message=response)
 
 
-@app.route('/ask_question', methods=['POST'])
-def ask_question():
-    data = request.get_json()
+@app.route('/define-selection/stream', methods=['POST'])
+def define_selection_stream():
+    prompt = define_selection_prompt(request_json())
+    debuglog.log('prompt', prompt)
+    return stream_generation(model, prompt, llmscheduler.INTERACTIVE, 'define_selection')
+
+
+@metrics.timed('prompt')
+def ask_question_prompt(data):
     user_query = str(data.get('user_query')).strip()
 
     # Process the selected text (e.g., save it, log it, etc.)
-    print(f"(ASK_QUESTION) Received selected text: {user_query}")
-    milvus_client = milvuslitebible.get_database(dbname)
-    milvus_returns = milvuslitebible.search_collection(query=user_query, client=milvus_client, collection_name=cname, metric='L2')
-    milvus_client.close()
+    debuglog.log('ASK_QUESTION', f"Received selected text: {user_query}")
+    milvus_returns = retriever.search(user_query, k=contextbuilder.candidates, version=reader_version(data))
+    context_string = contextbuilder.build([milvus_returns])
     prompt = f"""Below is some potential additional context verses that could be helpful for explaining a user's question:
-Context verse 1: \"{milvus_returns[0]['text']}\" - {milvus_returns[0]['title']}
-Context verse 2: \"{milvus_returns[1]['text']}\" - {milvus_returns[1]['title']}
-Context verse 3: \"{milvus_returns[2]['text']}\" - {milvus_returns[2]['title']}
-Context verse 4: \"{milvus_returns[3]['text']}\" - {milvus_returns[3]['title']}
-Context verse 5: \"{milvus_returns[4]['text']}\" - {milvus_returns[4]['title']}
-
+{context_string}
 In just a single sentence, answer the following user's question given the above context.
 In your answer do not reference any specific verses except for the ones given in this prompt.
 If you use any of the above Biblical context, properly reference it.
@@ -261,15 +500,44 @@ Now write your answer to the user's question using the above context.
 
 Response:
 """
-    print(prompt)
-    response = ollama.generate(model=model, prompt=prompt, keep_alive=-1)["response"]
-    print(response)
+
+    return prompt
+
+
+@metrics.timed('prompt')
+def ask_question_turn(data):
+    user_query = str(data.get('user_query')).strip()
+    debuglog.log('ASK_QUESTION', f"Received follow-up question: {user_query}")
+    milvus_returns = retriever.search(user_query, k=contextbuilder.candidates, version=reader_version(data))
+    return prompts.conversation_turn(user_query, contextbuilder.build([milvus_returns]))
+
+
+@app.route('/ask_question', methods=['POST'])
+def ask_question():
+    data = request_json()
+    turn = start_turn(data, ask_question_turn)
+    if turn is not None:
+        return jsonify(message=generate_turn(*turn, llmscheduler.QUESTION))
+    prompt = ask_question_prompt(data)
+    debuglog.log('prompt', prompt)
+    response = generate_text(model, prompt, llmscheduler.QUESTION, 'ask_question')
+    debuglog.log('response', response)
     return jsonify(message=response)
 
 
-@app.route('/ask-selection', methods=['POST'])
-def ask_selection():
-    data = request.get_json()
+@app.route('/ask_question/stream', methods=['POST'])
+def ask_question_stream():
+    data = request_json()
+    turn = start_turn(data, ask_question_turn)
+    if turn is not None:
+        return stream_turn(*turn, llmscheduler.QUESTION)
+    prompt = ask_question_prompt(data)
+    debuglog.log('prompt', prompt)
+    return stream_generation(model, prompt, llmscheduler.QUESTION, 'ask_question')
+
+
+@metrics.timed('prompt')
+def ask_selection_prompt(data):
     selected_text = str(data.get('selected_text')).strip()
     book = str(data.get('book')).strip()
     chapter = str(data.get('chapter')).strip()
@@ -279,26 +547,13 @@ def ask_selection():
     verse = full_context.split(')')[0]
     full_context = ')'.join(full_context.split(')')[1:]).strip()
 
-    print(full_context)
+    debuglog.log('context', full_context)
 
     # Process the selected text (e.g., save it, log it, etc.)
-    print(f"(ASK_SELECTION) Received selected text: {selected_text}")
-    milvus_client = milvuslitebible.get_database(dbname)
-    milvus_returns_context = milvuslitebible.search_collection(query=selected_text, client=milvus_client, collection_name=cname, metric='L2')
-    milvus_returns_question = milvuslitebible.search_collection(query=user_query, client=milvus_client,collection_name=cname, metric='L2')
-    milvus_client.close()
-
-    context_verses = []
-
-    for context in milvus_returns_context:
-        context_verses.append(f"\"{context['text']}\" - {context['title']}")
-    for context in milvus_returns_question:
-        context_verses.append(f"\"{context['text']}\" - {context['title']}")
-
-    context_verses = list(set(context_verses))
-    context_string = ""
-    for i in range(len(context_verses)):
-        context_string += f"Context verse {i+1}: {context_verses[i]}\n"
+    debuglog.log('ASK_SELECTION', f"Received selected text: {selected_text}")
+    milvus_returns_context, milvus_returns_question = retriever.search_many([selected_text, user_query], k=contextbuilder.candidates, version=reader_version(data))
+    # Both result lists share one budget; verses found by both searches rank higher instead of appearing twice
+    context_string = contextbuilder.build([milvus_returns_context, milvus_returns_question], exclude=[contextbuilder.reference(book, chapter, verse)])
 
     prompt = f"""Below is some potential additional context verses that could be helpful for explaining a later question from a user:
 {context_string}
@@ -316,95 +571,87 @@ Now write your answer to the user's question using the above context.
 Response:
 """
 
-    print(prompt)
-    response = ollama.generate(model=model, prompt=prompt, keep_alive=-1)["response"]
-    print(response)
+    return prompt
+
+
+@metrics.timed('prompt')
+def ask_selection_turn(data):
+    selected_text = str(data.get('selected_text')).strip()
+    book = str(data.get('book')).strip()
+    chapter = str(data.get('chapter')).strip()
+    user_query = str(data.get('user_query')).strip()
+    verse = str(data.get('full_context')).strip().split(')')[0]
+
+    # The verse itself is already in the chapter text at the start of the conversation
+    debuglog.log('ASK_SELECTION', f"Received follow-up on selected text: {selected_text}")
+    milvus_returns_context, milvus_returns_question = retriever.search_many([selected_text, user_query], k=contextbuilder.candidates, version=reader_version(data))
+    context_string = contextbuilder.build([milvus_returns_context, milvus_returns_question], exclude=[contextbuilder.reference(book, chapter, verse)])
+    return prompts.conversation_turn(user_query, context_string, selected_text)
+
+
+@app.route('/ask-selection', methods=['POST'])
+def ask_selection():
+    data = request_json()
+    turn = start_turn(data, ask_selection_turn)
+    if turn is not None:
+        return jsonify(message=generate_turn(*turn, llmscheduler.QUESTION))
+    prompt = ask_selection_prompt(data)
+    debuglog.log('prompt', prompt)
+    response = generate_text(model, prompt, llmscheduler.QUESTION, 'ask_selection')
+    debuglog.log('response', response)
     return jsonify(message=response)
 
 
-@app.route('/get_quiz', methods=['POST'])
-def get_quiz():
-    data = request.get_json()
+@app.route('/ask-selection/stream', methods=['POST'])
+def ask_selection_stream():
+    data = request_json()
+    turn = start_turn(data, ask_selection_turn)
+    if turn is not None:
+        return stream_turn(*turn, llmscheduler.QUESTION)
+    prompt = ask_selection_prompt(data)
+    debuglog.log('prompt', prompt)
+    return stream_generation(model, prompt, llmscheduler.QUESTION, 'ask_selection')
 
-    full_context = ast.literal_eval(str(data.get('full_context')).strip())
 
-    contextual_text = ""
-    for context in full_context:
-        contextual_text += f'{context.strip()}\n'
+def chapter_reference_context(data):
+    # The client only names the chapter (and optionally a verse range); the text comes from the chapter store
+    book = str(data.get('book')).strip()
+    chapter = str(data.get('chapter')).strip()
+    version = reader_version(data)
+    verses = chapters.get(book, chapter, version)
+    return book, chapter, prompts.chapter_context(verses, data.get('verse_start'), data.get('verse_end'))
+
+
+@app.route('/get_quiz', methods=['POST'])
+def get_quiz():
+    data = request_json()
+    book, chapter, contextual_text = chapter_reference_context(data)
 
     # Process the selected text (e.g., save it, log it, etc.)
-    print(f"(GET_QUIZ) Received selected text: {full_context}")
-
-    prompt = f"""Based on the following context, generate a valid JSON object for a Bible quiz. 
-
-The JSON object must follow these rules:
-    1. Each key must be a question derived from the context.
-    2. Each value must be a dictionary with:
-        - 'options': A dictionary containing exactly 4 keys: 'A', 'B', 'C', 'D'. Each key must have a potential answer as its value.
-        - 'answer': The correct answer (one of 'A', 'B', 'C', 'D') based on the context.
-
-Output Rules:
-    - The output must be a valid JSON object with no extra text, explanations, or formatting like ```json or ###Quiz Question.
-    - Ensure the questions and answers are derived strictly from the context.
-    - Questions must not use generic names like "Question 1" or "Quiz Question."
-    - Answers must stay within the boundaries of the context. Do not invent answers or questions.
-    - There should be 1 objectively correct answer and 3 objectively wrong answers in your 'options'.
-
-Here is an example of the required format:
-    {{
-        "What was the first miracle Jesus performed?": {{
-            "options": {{
-                "A": "Turning water into wine",
-                "B": "Feeding the 5,000",
-                "C": "Healing a blind man",
-                "D": "Walking on water"
-            }},
-            "answer": "A"
-        }},
-        "Where did Jesus perform his first miracle?": {{
-            "options": {{
-                "A": "Cana",
-                "B": "Bethlehem",
-                "C": "Jerusalem",
-                "D": "Nazareth"
-            }},
-            "answer": "A"
-        }}
-    }}
-
-NOTE: Do NOT use the above example questions in your generated questions. The above example is just a format example.
-
-Context:
-    {contextual_text}
-
-Now generate 3 quiz questions in this JSON format.
-Response:
-"""
+    debuglog.log('GET_QUIZ', f"Received chapter: {book} {chapter}")
 
-    # print(prompt)
-    response = ollama.generate(model=quiz_model, prompt=prompt, keep_alive=-1)["response"]
+    with metrics.span('prompt'):
+        prompt = prompts.quiz_prompt(contextual_text)
 
-    # Find the position of the first '{' and the last '}'
-    start = response.find('{')
-    end = response.rfind('}')
+    # print(prompt)
+    response = generate_text(quiz_model, prompt, llmscheduler.BATCH, 'get_quiz', cacheable=lambda text: prompts.extract_json(text) is not None)
 
-    # Ensure both brackets are found
-    if start == -1 or end == -1 or start > end:
-        print(response)
+    quiz_json = prompts.extract_json(response)
+    if quiz_json is None:
+        debuglog.log('response', response)
         return jsonify(error="Input string does not contain a valid JSON structure.")
 
     # Extract and return the substring containing the JSON content
-    response = response[start:end + 1]
-    # print(response)
+    response = quiz_json
 
-    print(response)
+    debuglog.log('response', response)
     return jsonify(message=response)
 
 
 @app.route('/submit_quiz', methods=['POST'])
 def submit_quiz():
-    data = request.get_json()
-    print(data)
+    data = request_json()
+    debuglog.log('SUBMIT_QUIZ', data)
     user_answers = ast.literal_eval(str(data.get('quiz_results')).strip())
     quiz_answers = ast.literal_eval(str(data.get('quiz_answers')).strip())
 
@@ -417,38 +664,38 @@ def submit_quiz():
     return jsonify(message=f"You got {correct}/{len(quiz_answers)} correct!")
 
 
-@app.route('/summarize_chapter', methods=['POST'])
-def summarize_chapter():
-    data = request.get_json()
+@metrics.timed('prompt')
+def summarize_chapter_prompt(data):
+    book, chapter, contextual_text = chapter_reference_context(data)
 
-    full_context = ast.literal_eval(str(data.get('full_context')).strip())
-    book = str(data.get('book')).strip()
-    chapter = str(data.get('chapter')).strip()
+    prompt = prompts.summary_prompt(book, chapter, contextual_text)
 
-    contextual_text = ""
-    for context in full_context:
-        contextual_text += f'{context.strip()}\n'
+    return prompt
 
-    prompt = f"""Summarize the following Biblical Scripture from chapter {chapter} of the book of {book}:
-{contextual_text}
-Now summarize the above Scripture.
-    
-Response:
-"""
 
-    print(prompt)
-    response = ollama.generate(model=model, prompt=prompt, keep_alive=-1)["response"]
-    print(response)
+@app.route('/summarize_chapter', methods=['POST'])
+def summarize_chapter():
+    prompt = summarize_chapter_prompt(request_json())
+    debuglog.log('prompt', prompt)
+    response = generate_text(model, prompt, llmscheduler.BATCH, 'summarize_chapter')
+    debuglog.log('response', response)
     return jsonify(message=response)
 
 
+@app.route('/summarize_chapter/stream', methods=['POST'])
+def summarize_chapter_stream():
+    prompt = summarize_chapter_prompt(request_json())
+    debuglog.log('prompt', prompt)
+    return stream_generation(model, prompt, llmscheduler.BATCH, 'summarize_chapter')
+
+
 @app.route('/search-selection', methods=['POST'])
 def search_selection():
-    data = request.get_json()
+    data = request_json()
     selected_text = str(data.get('selected_text')).strip().translate(str.maketrans('', '', string.punctuation))
 
     # Process the selected text (e.g., save it, log it, etc.)
-    print(f"(SEARCH_SELECTION) Received selected text: {selected_text}")
+    debuglog.log('SEARCH_SELECTION', f"Received selected text: {selected_text}")
 
     image_array = bs4bible.search(selected_text)
     # image_dictionary = {'images': image_array}
@@ -457,16 +704,32 @@ def search_selection():
 
 @app.route('/search-map-selection', methods=['POST'])
 def search_map_selection():
-    data = request.get_json()
+    data = request_json()
     selected_text = str(data.get('selected_text')).strip().translate(str.maketrans('', '', string.punctuation))
 
     # Process the selected text (e.g., save it, log it, etc.)
-    print(f"(SEARCH_MAP_SELECTION) Received selected text: {selected_text}")
+    debuglog.log('SEARCH_MAP_SELECTION', f"Received selected text: {selected_text}")
 
     map_array = bs4bible.searchmap(selected_text)
     # map_dictionary = {'images': map_array}
     return jsonify(images=map_array)
 
 
+@app.route('/search-all-selection', methods=['POST'])
+def search_all_selection():
+    data = request_json()
+    selected_text = str(data.get('selected_text')).strip().translate(str.maketrans('', '', string.punctuation))
+
+    # Process the selected text (e.g., save it, log it, etc.)
+    debuglog.log('SEARCH_ALL_SELECTION', f"Received selected text: {selected_text}")
+
+    image_array, map_array = bs4bible.search_all(selected_text)
+    return jsonify(images=image_array, maps=map_array)
+
+
+startup.mark('routes')
+startup.report()
+
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=25565, debug=True)
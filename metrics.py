@@ -0,0 +1,124 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; Prometheus adds the +Inf bucket
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Which route the current thread is serving, so spans deep in the call stack are labelled with it
+current = threading.local()
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, bounds=buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.bounds = bounds
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.bounds) + 1), 0.0]
+            series[0][bisect.bisect_left(self.bounds, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            label_text = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount, *labels):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series = dict(self.series)
+        for labels, value in sorted(series.items()):
+            label_text = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.label_names, labels))
+            lines.append(f'{self.name}{{{label_text}}} {value}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+stage_seconds = Histogram('aibible_stage_seconds', 'Time spent in each stage of a request.', ('stage', 'route'))
+request_seconds = Histogram('aibible_request_seconds', 'Time from receiving a request until its response finished.', ('route', 'status'))
+tokens_total = Counter('aibible_tokens_total', 'Prompt and completion tokens processed by Ollama.', ('model', 'kind'))
+
+
+def route():
+    return getattr(current, 'route', None) or 'none'
+
+
+def observe(stage, seconds):
+    stage_seconds.observe(seconds, stage, route())
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_generation(model, result):
+    # Ollama reports durations in nanoseconds on the final (or only) response
+    prompt_duration = result.get('prompt_eval_duration')
+    eval_duration = result.get('eval_duration')
+    load_duration = result.get('load_duration')
+    if load_duration:
+        observe('model_load', load_duration / 1e9)
+    if prompt_duration:
+        observe('prefill', prompt_duration / 1e9)
+    if eval_duration:
+        observe('generation', eval_duration / 1e9)
+    tokens_total.inc(result.get('prompt_eval_count') or 0, model, 'prompt')
+    tokens_total.inc(result.get('eval_count') or 0, model, 'completion')
+
+
+def render():
+    lines = []
+    for metric in (request_seconds, stage_seconds, tokens_total):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
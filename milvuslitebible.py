@@ -1,60 +1,243 @@
+import atexit
 import embedding
+import lrucache
+import metrics
+import numpy as np
 import os
-from pymilvus import MilvusClient
+import threading
+import time
+import vectorcodec
+
+# Top-k hits keyed on normalized query + mode + collection + metric + k + version partition
+results_cache = lrucache.LRUCache(max_entries=2048, max_bytes=32 * 1024 * 1024, sizeof=lambda hits: sum(len(hit['text']) + len(hit['title']) + 100 for hit in hits))
+
+
+def open_client(path):
+    # pymilvus is slow to import, so it is only loaded once a database is actually opened
+    from pymilvus import MilvusClient
+    return MilvusClient(path)
 
 
 def get_database(database_name):
     directory = os.listdir()
     if database_name + '.db' in directory:
         print(f'Milvus Lite contains {database_name} database. Returning database.')
-        return MilvusClient(f'./{database_name}.db')
+        return open_client(f'./{database_name}.db')
     else:
         print(f'Database {database_name} does not exist in Milvus Lite.')
         return None
 
 
-def create_collection(collection_name, database_name, embeddings, metric):
+def create_collection(collection_name, database_name, embeddings, metric, partitions=()):
     # Define fields for collection, including a text field
-    milvus_client = MilvusClient(f'./{database_name}.db')
+    milvus_client = open_client(f'./{database_name}.db')
     milvus_client.create_collection(collection_name, dimension=embeddings.shape[1], metric_type=metric)
+    # One partition per Bible version, so a search only scans the version being read
+    for partition in partitions:
+        milvus_client.create_partition(collection_name=collection_name, partition_name=partition)
 
     return milvus_client
 
 
-def insert_data(collection_name, client, embeddings, texts, titles, ids):
-    # Convert embeddings to a list suitable for Milvus
+def insert_data(collection_name, client, embeddings, texts, titles, ids, upsert=False, partition_name=None, verse_ids=None):
     try:
-        embedding_list = embeddings.tolist()
+        # pymilvus converts every row to a list of floats itself; its column-based insert flattens every float in
+        # Python too, and the insert time is spent in Milvus Lite either way
+        vectors = np.asarray(embeddings)
 
-        data = [{'id': ids[i], 'vector': embedding_list[i], 'text': texts[i], 'title': titles[i]} for i in range(len(embedding_list))]
+        data = [{'id': ids[i], 'vector': vectors[i], 'text': texts[i], 'title': titles[i]} for i in range(len(vectors))]
+        if partition_name is not None:
+            for i in range(len(data)):
+                data[i]['version'] = partition_name
+                data[i]['verse_id'] = verse_ids[i]
 
         # Insert the embeddings and their corresponding texts in to the collection
-        client.insert(collection_name=collection_name, data=data)
+        if upsert:
+            # Re-inserting an existing id replaces it, so a resumed run can safely repeat a batch
+            client.upsert(collection_name=collection_name, data=data, partition_name=partition_name)
+        else:
+            client.insert(collection_name=collection_name, data=data, partition_name=partition_name)
         print("Embeddings and texts successfully inserted into the collection")
+        return True
     except Exception as e:
         print(f'Embeddings and texts could not be inserted')
         print(e)
+        return False
 
 
-def search_collection(query, client, collection_name, metric):
-    # Generate the embeddings for the query
-    query_embedding = embedding.embed_documents([query], "query")
-    query_embedding = query_embedding.tolist()
+def search_collection(query, client, collection_name, metric, limit=5, partition=None, codec=None):
+    key = (embedding.normalize_text(query), 'query', collection_name, metric, limit, partition)
+    return_values = results_cache.get(key)
+    if return_values is None:
+        # Generate the embeddings for the query
+        query_embedding = encode_queries([embedding.get_cached_embedding(query, "query")], codec)
+        return_values = search_vectors(query_embedding, client, collection_name, metric, limit, partition)[0]
+        results_cache.put(key, return_values)
+    return return_values
+
 
+def search_vectors(query_embeddings, client, collection_name, metric, limit=5, partition=None):
     # Perform the search and request the text field to be returned
     results = client.search(
         collection_name=collection_name,
-        data=query_embedding,
-        limit=5,  # Number of documents to be retrieved
+        data=query_embeddings,
+        limit=limit,  # Number of documents to be retrieved
         output_fields=['title', 'text'],
-        search_params={'metric_type': metric, 'params': {}}
+        search_params={'metric_type': metric, 'params': {}},
+        partition_names=[partition] if partition is not None else None
     )
 
-    return_values = []
-    for result in results[0]:
-        return_values.append({'title': result['entity']['title'], 'text': result['entity']['text'], 'distance': result['distance']})
-    return return_values
+    all_return_values = []
+    for hits in results:
+        return_values = []
+        for result in hits:
+            return_values.append({'title': result['entity']['title'], 'text': result['entity']['text'], 'distance': result['distance']})
+        all_return_values.append(return_values)
+    return all_return_values
+
+
+def encode_queries(vectors, codec):
+    # Queries get the same normalization, projection and precision as the stored verse vectors
+    if codec is None:
+        return [vector.tolist() for vector in vectors]
+    return list(codec.encode(np.stack(vectors)))
 
 
 def drop_collection(client, collection_name):
     client.drop_collection(collection_name=collection_name)
+
+
+def generation_path(database_name):
+    return f'./{database_name}.generation'
+
+
+def get_generation(database_name):
+    # Bumped by invalidate_cache whenever fill_milvus_lite.py rebuilds the collection
+    try:
+        return os.stat(generation_path(database_name)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def invalidate_cache(database_name=None):
+    results_cache.clear()
+    if database_name is not None:
+        with open(generation_path(database_name), 'w') as f:
+            f.write(str(time.time_ns()))
+
+
+class BibleRetriever:
+    # Keeps one Milvus Lite connection open for the life of the process instead of one per request
+    def __init__(self, database_name, collection_name, metric='L2'):
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self.metric = metric
+        self.client = None
+        self.partitions = set()
+        self.codec = None
+        self.generation = get_generation(database_name)
+        self.lock = threading.Lock()
+
+    def connect(self):
+        with self.lock:
+            if self.client is None:
+                if not os.path.exists(f'./{self.database_name}.db'):
+                    raise FileNotFoundError(f'Database {self.database_name} does not exist in Milvus Lite.')
+                client = open_client(f'./{self.database_name}.db')
+                # Keep the collection resident in memory so searches never wait on a load
+                client.load_collection(self.collection_name)
+                # Versions indexed as partitions; a single-version collection has none and is searched whole
+                self.partitions = set(client.list_partitions(self.collection_name)) - {'_default'}
+                # Written by fill_milvus_lite.py; the stored vectors decide the metric
+                self.codec = vectorcodec.VectorCodec.load(self.collection_name)
+                if self.codec is not None:
+                    self.metric = self.codec.metric
+                self.client = client
+                print(f'Opened {self.collection_name} in {self.database_name} database.')
+            return self.client
+
+    def reconnect(self, client):
+        with self.lock:
+            # Another thread may already have replaced the broken client
+            if self.client is client:
+                try:
+                    client.close()
+                except Exception as e:
+                    print(e)
+                self.client = None
+        return self.connect()
+
+    def check_generation(self):
+        generation = get_generation(self.database_name)
+        if generation != self.generation:
+            # The collection was rebuilt by another process, so cached hits and the open handle are stale
+            print(f'{self.collection_name} was rebuilt. Clearing cached search results.')
+            results_cache.clear()
+            self.generation = generation
+            client = self.client
+            if client is not None:
+                self.reconnect(client)
+
+    def partition(self, version):
+        # Searches are pruned to the reader's version when it has its own partition
+        self.connect()
+        return version if version in self.partitions else None
+
+    def search(self, query, k=5, version=None):
+        return self.search_many([query], k, version)[0]
+
+    def search_many(self, queries, k=5, version=None):
+        # One forward pass and one client.search for every query that is not already cached
+        self.check_generation()
+        partition = self.partition(version)
+        keys = [(embedding.normalize_text(query), 'query', self.collection_name, self.metric, k, partition) for query in queries]
+        all_return_values = [results_cache.get(key) for key in keys]
+        missing = [i for i in range(len(queries)) if all_return_values[i] is None]
+        if missing:
+            query_embeddings = embedding.get_cached_embeddings([queries[i] for i in missing], "query")
+            with metrics.span('vector_search'):
+                found = self.search_vectors(encode_queries(query_embeddings, self.codec), k, partition)
+            for i, return_values in zip(missing, found):
+                all_return_values[i] = return_values
+                results_cache.put(keys[i], return_values)
+        return all_return_values
+
+    def search_vectors(self, query_embeddings, k=5, partition=None):
+        client = self.connect()
+        try:
+            return search_vectors(query_embeddings, client, self.collection_name, self.metric, k, partition)
+        except Exception as e:
+            print(f'Search on {self.collection_name} failed, reconnecting: {e}')
+            client = self.reconnect(client)
+            return search_vectors(query_embeddings, client, self.collection_name, self.metric, k, partition)
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                try:
+                    self.client.close()
+                finally:
+                    self.client = None
+
+
+retrievers = {}
+retrievers_lock = threading.Lock()
+
+
+def get_retriever(database_name, collection_name, metric='L2'):
+    # One shared retriever per (database, collection, metric) for the whole process
+    key = (database_name, collection_name, metric)
+    with retrievers_lock:
+        if key not in retrievers:
+            retrievers[key] = BibleRetriever(database_name, collection_name, metric)
+        return retrievers[key]
+
+
+def close_retrievers():
+    with retrievers_lock:
+        for retriever in retrievers.values():
+            retriever.close()
+        retrievers.clear()
+
+
+atexit.register(close_retrievers)
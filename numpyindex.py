@@ -0,0 +1,204 @@
+import argparse
+import json
+import milvuslitebible
+import numpy as np
+import os
+import threading
+import vectorcodec
+
+# Rows scored per matrix multiply when the matrix is stored as float16
+block_rows = 8192
+
+
+def index_paths(prefix):
+    return {
+        'vectors': f'{prefix}.vectors.npy',
+        'ids': f'{prefix}.ids.npy',
+        'offsets': f'{prefix}.offsets.npy',
+        'text': f'{prefix}.text.bin',
+        'partitions': f'{prefix}.partitions.json',
+    }
+
+
+def write_index(prefix, ids, vectors, titles, texts, dtype='float32', partitions=None):
+    # Titles and texts share one UTF-8 blob; each row stores (start, end of title, end of text)
+    paths = index_paths(prefix)
+    blob = bytearray()
+    offsets = np.empty((len(ids), 3), dtype=np.int64)
+    for i in range(len(ids)):
+        offsets[i, 0] = len(blob)
+        blob += titles[i].encode('utf-8')
+        offsets[i, 1] = len(blob)
+        blob += texts[i].encode('utf-8')
+        offsets[i, 2] = len(blob)
+    np.save(paths['vectors'], np.ascontiguousarray(vectors, dtype=dtype))
+    np.save(paths['ids'], np.asarray(ids, dtype=np.int64))
+    np.save(paths['offsets'], offsets)
+    with open(paths['text'], 'wb') as f:
+        f.write(bytes(blob))
+    if partitions:
+        # Version -> [first row, last row + 1]; rows of a version are contiguous because ids start with the version
+        with open(paths['partitions'], 'w') as f:
+            json.dump(partitions, f)
+    elif os.path.exists(paths['partitions']):
+        os.remove(paths['partitions'])
+    print(f'Wrote {len(ids)} {dtype} vectors to {paths["vectors"]}')
+
+
+def row_vector(vector):
+    # FLOAT16_VECTOR fields come back from Milvus as raw bytes
+    if isinstance(vector, list) and vector and isinstance(vector[0], bytes):
+        vector = vector[0]
+    if isinstance(vector, bytes):
+        return np.frombuffer(vector, dtype=np.float16)
+    return np.asarray(vector, dtype=np.float32)
+
+
+def export_from_milvus(client, collection_name, prefix, dtype='float32', page_size=4096):
+    # Pages through the live rows until an empty page; row_count still includes upserted and deleted rows until compaction
+    rows = []
+    # A freshly opened Milvus Lite database has every collection released
+    client.load_collection(collection_name)
+    iterator = client.query_iterator(collection_name=collection_name, batch_size=page_size, filter='', output_fields=['id', 'vector', 'title', 'text', 'version'])
+    try:
+        while True:
+            page = iterator.next()
+            if not page:
+                break
+            rows += page
+    finally:
+        iterator.close()
+    rows.sort(key=lambda row: row['id'])
+    partitions = {}
+    for i, row in enumerate(rows):
+        version = row.get('version')
+        if version is None:
+            continue
+        if version in partitions and partitions[version][1] != i:
+            raise ValueError(f'Rows of {version} are not contiguous by id')
+        partitions.setdefault(version, [i, i])[1] = i + 1
+    # Queries against the export need the same transform as the collection, so the codec is copied alongside it
+    codec = vectorcodec.VectorCodec.load(collection_name)
+    if codec is not None:
+        codec.save(prefix)
+        if codec.dtype == np.float16:
+            dtype = 'float16'
+    write_index(prefix, [row['id'] for row in rows], np.stack([row_vector(row['vector']) for row in rows]).astype(np.float32), [row['title'] for row in rows], [row['text'] for row in rows], dtype, partitions)
+
+
+class NumpyRetriever(milvuslitebible.BibleRetriever):
+    # Exact top-k over a memory-mapped matrix; same interface as the Milvus Lite retriever
+    def __init__(self, prefix, metric='L2'):
+        assert metric in ('L2', 'IP'), f'metric={metric} was passed but only `L2` and `IP` are supported.'
+        self.prefix = prefix
+        self.paths = index_paths(prefix)
+        self.collection_name = f'numpy:{prefix}'
+        self.metric = metric
+        self.vectors = None
+        self.partitions = set()
+        self.ranges = {}
+        self.codec = None
+        self.generation = self.get_generation()
+        self.lock = threading.Lock()
+
+    def get_generation(self):
+        try:
+            return os.stat(self.paths['vectors']).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def connect(self):
+        with self.lock:
+            if self.vectors is None:
+                self.ids = np.load(self.paths['ids'])
+                self.offsets = np.load(self.paths['offsets'])
+                with open(self.paths['text'], 'rb') as f:
+                    self.blob = f.read()
+                if os.path.exists(self.paths['partitions']):
+                    with open(self.paths['partitions'], 'r') as f:
+                        self.ranges = json.load(f)
+                else:
+                    self.ranges = {}
+                self.partitions = set(self.ranges)
+                self.codec = vectorcodec.VectorCodec.load(self.prefix)
+                if self.codec is not None:
+                    self.metric = self.codec.metric
+                vectors = np.load(self.paths['vectors'], mmap_mode='r')
+                if self.metric == 'L2':
+                    # Squared norms of the rows, so L2 distance only needs the matrix product per query
+                    self.norms = np.concatenate([(np.asarray(vectors[i:i + block_rows], dtype=np.float32) ** 2).sum(axis=1) for i in range(0, len(vectors), block_rows)])
+                self.vectors = vectors
+                print(f'Opened {self.paths["vectors"]} with {len(vectors)} {vectors.dtype} vectors.')
+            return self.vectors
+
+    def reconnect(self, client=None):
+        self.close()
+        return self.connect()
+
+    def check_generation(self):
+        generation = self.get_generation()
+        if generation != self.generation:
+            print(f'{self.paths["vectors"]} was rebuilt. Clearing cached search results.')
+            milvuslitebible.results_cache.clear()
+            self.generation = generation
+            self.reconnect()
+
+    def scores(self, queries, partition=None):
+        vectors = self.connect()
+        start, end = self.ranges[partition] if partition is not None else (0, len(vectors))
+        # Slicing the memory map only touches the pages of that version
+        vectors = vectors[start:end]
+        if vectors.dtype == np.float32:
+            products = queries @ vectors.T
+        else:
+            # Upcast one block at a time so a float16 matrix is never copied whole
+            products = np.concatenate([queries @ np.asarray(vectors[i:i + block_rows], dtype=np.float32).T for i in range(0, len(vectors), block_rows)], axis=1)
+        if self.metric == 'IP':
+            return -products, products
+        distances = (queries ** 2).sum(axis=1)[:, None] - 2 * products + self.norms[None, start:end]
+        return distances, distances
+
+    def search_vectors(self, query_embeddings, k=5, partition=None):
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        order_keys, distances = self.scores(queries, partition)
+        first_row = self.ranges[partition][0] if partition is not None else 0
+        k = min(k, order_keys.shape[1])
+        candidates = np.argpartition(order_keys, k - 1, axis=1)[:, :k]
+        all_return_values = []
+        for row, row_candidates in enumerate(candidates):
+            ranked = row_candidates[np.argsort(order_keys[row, row_candidates])]
+            return_values = []
+            for i in ranked:
+                start, title_end, text_end = self.offsets[first_row + i]
+                return_values.append({'title': self.blob[start:title_end].decode('utf-8'), 'text': self.blob[title_end:text_end].decode('utf-8'), 'distance': float(distances[row, i])})
+            all_return_values.append(return_values)
+        return all_return_values
+
+    def close(self):
+        with self.lock:
+            self.vectors = None
+
+
+retrievers = {}
+retrievers_lock = threading.Lock()
+
+
+def get_retriever(prefix, metric='L2'):
+    key = (prefix, metric)
+    with retrievers_lock:
+        if key not in retrievers:
+            retrievers[key] = NumpyRetriever(prefix, metric)
+        return retrievers[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the Milvus Lite collection to a memory-mapped NumPy index.')
+    parser.add_argument('--database', default='milvuslitebible')
+    parser.add_argument('--collection', default='milvuslitebible_bible')
+    parser.add_argument('--prefix', default='milvuslitebible_bible')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float16'])
+    args = parser.parse_args()
+
+    client = milvuslitebible.open_client(f'./{args.database}.db')
+    export_from_milvus(client, args.collection, args.prefix, args.dtype)
+    client.close()
@@ -0,0 +1,85 @@
+import argparse
+import artifacts
+import chapterstore
+import ollama
+import os
+import prompts
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def chapter_prompt(kind, book, chapter, verses):
+    contextual_text = prompts.chapter_context(verses)
+    if kind == 'summary':
+        return prompts.summary_prompt(book, chapter, contextual_text)
+    return prompts.quiz_prompt(contextual_text)
+
+
+def generate(kind, model, prompt, attempts):
+    # Quizzes are regenerated until the JSON is valid; summaries are accepted as they come
+    for attempt in range(attempts):
+        response = ollama.generate(model=model, prompt=prompt, keep_alive=-1)["response"]
+        if kind == 'summary':
+            return response
+        if prompts.valid_quiz(response):
+            return prompts.extract_json(response)
+    return None
+
+
+def run(args):
+    store = artifacts.ArtifactStore(args.db)
+    chapters = chapterstore.ChapterStore(args.versions, args.books, args.data_dir, pack_path=args.pack if os.path.exists(args.pack) else None)
+    models = {'summary': args.summary_model, 'quiz': args.quiz_model}
+
+    # Only chapters whose prompt or model changed since the last run are generated again
+    jobs = []
+    skipped = 0
+    for version, book, chapter in chapterstore.iter_chapters(args.versions, args.books, args.data_dir):
+        verses = chapters.get(book, chapter, version)
+        for kind in args.kinds:
+            prompt = chapter_prompt(kind, book, chapter, verses)
+            if store.is_current(kind, version, book, chapter, models[kind], prompt):
+                skipped += 1
+            else:
+                jobs.append((kind, version, book, chapter, prompt))
+    print(f'{len(jobs)} artifacts to generate, {skipped} already up to date.')
+
+    start = time.perf_counter()
+    done = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(generate, kind, models[kind], prompt, args.attempts): (kind, version, book, chapter, prompt) for kind, version, book, chapter, prompt in jobs}
+        for future in as_completed(futures):
+            kind, version, book, chapter, prompt = futures[future]
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f'{kind} for {book} {chapter} ({version}) failed: {e}')
+                response = None
+            if response is None:
+                failed += 1
+                continue
+            # Each result is committed as soon as it finishes, so an interrupted run resumes where it stopped
+            store.put(kind, version, book, chapter, models[kind], prompt, response)
+            done += 1
+            if done % 25 == 0:
+                print(f'Generated {done}/{len(jobs)} ({done / (time.perf_counter() - start):.2f} per second)')
+
+    print(f'Generated {done} artifacts, {failed} failed, in {time.perf_counter() - start:.1f}s')
+    print(store.stats())
+    store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute chapter summaries and quizzes so the routes can serve them instantly.')
+    parser.add_argument('--kinds', nargs='+', default=['summary', 'quiz'], choices=['summary', 'quiz'])
+    parser.add_argument('--versions', nargs='+', default=chapterstore.version_selection)
+    parser.add_argument('--books', nargs='+', default=chapterstore.in_order)
+    parser.add_argument('--workers', type=int, default=2, help='Concurrent generations sent to Ollama.')
+    parser.add_argument('--attempts', type=int, default=3, help='Tries per quiz before giving up on invalid JSON.')
+    parser.add_argument('--summary-model', default='qwen2.5:1.5b')
+    parser.add_argument('--quiz-model', default='qwen2.5-coder:3b')
+    parser.add_argument('--db', default='artifacts.db')
+    parser.add_argument('--pack', default='chapters.pack')
+    parser.add_argument('--data-dir', default=chapterstore.data_dir)
+    run(parser.parse_args())
@@ -0,0 +1,162 @@
+import json
+import re
+
+tag_pattern = re.compile(r'<[^>]+>')
+
+
+def chapter_lines(verses):
+    # Rendered verses as the reader sees them, matching the text of each <p> on the page
+    return [tag_pattern.sub('', verse) for verse in verses]
+
+
+class BadVerseRange(ValueError):
+    pass
+
+
+def verse_number(value):
+    value = str(value).strip()
+    if not value.isdigit() or int(value) < 1:
+        raise BadVerseRange(f'{value!r} is not a verse number')
+    return int(value)
+
+
+def select_verses(verses, verse_start=None, verse_end=None):
+    # Headings are only kept for whole chapters; a verse range keeps just the numbered verses inside it
+    if verse_start is None and verse_end is None:
+        return verses
+    start = verse_number(verse_start) if verse_start is not None else 1
+    end = verse_number(verse_end) if verse_end is not None else None
+    if end is not None and end < start:
+        raise BadVerseRange(f'Verse range {start}-{end} is reversed')
+    selected = []
+    for verse in verses:
+        number = verse.split(')', 1)[0]
+        if number.isdigit() and int(number) >= start and (end is None or int(number) <= end):
+            selected.append(verse)
+    return selected
+
+
+def chapter_context(verses, verse_start=None, verse_end=None):
+    return context_text(chapter_lines(select_verses(verses, verse_start, verse_end)))
+
+
+def context_text(lines):
+    contextual_text = ""
+    for context in lines:
+        contextual_text += f'{context.strip()}\n'
+    return contextual_text
+
+
+def quiz_prompt(contextual_text):
+    return f"""Based on the following context, generate a valid JSON object for a Bible quiz. 
+
+The JSON object must follow these rules:
+    1. Each key must be a question derived from the context.
+    2. Each value must be a dictionary with:
+        - 'options': A dictionary containing exactly 4 keys: 'A', 'B', 'C', 'D'. Each key must have a potential answer as its value.
+        - 'answer': The correct answer (one of 'A', 'B', 'C', 'D') based on the context.
+
+Output Rules:
+    - The output must be a valid JSON object with no extra text, explanations, or formatting like ```json or ###Quiz Question.
+    - Ensure the questions and answers are derived strictly from the context.
+    - Questions must not use generic names like "Question 1" or "Quiz Question."
+    - Answers must stay within the boundaries of the context. Do not invent answers or questions.
+    - There should be 1 objectively correct answer and 3 objectively wrong answers in your 'options'.
+
+Here is an example of the required format:
+    {{
+        "What was the first miracle Jesus performed?": {{
+            "options": {{
+                "A": "Turning water into wine",
+                "B": "Feeding the 5,000",
+                "C": "Healing a blind man",
+                "D": "Walking on water"
+            }},
+            "answer": "A"
+        }},
+        "Where did Jesus perform his first miracle?": {{
+            "options": {{
+                "A": "Cana",
+                "B": "Bethlehem",
+                "C": "Jerusalem",
+                "D": "Nazareth"
+            }},
+            "answer": "A"
+        }}
+    }}
+
+NOTE: Do NOT use the above example questions in your generated questions. The above example is just a format example.
+
+Context:
+    {contextual_text}
+
+Now generate 3 quiz questions in this JSON format.
+Response:
+"""
+
+
+def summary_prompt(book, chapter, contextual_text):
+    return f"""Summarize the following Biblical Scripture from chapter {chapter} of the book of {book}:
+{contextual_text}
+Now summarize the above Scripture.
+    
+Response:
+"""
+
+
+def conversation_prefix(book, chapter, contextual_text):
+    # Kept identical for every turn about a chapter so Ollama can reuse its cached prefill
+    return f"""Below is the full text of {book} {chapter}, which the user is reading:
+{contextual_text}
+The user will ask a series of questions about this chapter.
+Answer each question in just a single sentence.
+If you use any of the Biblical context in this conversation, properly reference it.
+In your answers do not reference any specific verses except for the ones given in this conversation.
+
+"""
+
+
+def conversation_turn(user_query, context_string, selected_text=None):
+    turn = ""
+    if context_string:
+        turn += f"""Below is some potential additional context verses that could be helpful for the next question:
+{context_string}
+"""
+    if selected_text:
+        turn += f"""Section the user highlighted and has questions about: \"{selected_text}\".
+"""
+    turn += f"""User's question: {user_query}
+
+Response:
+"""
+    return turn
+
+
+def extract_json(response):
+    # Find the position of the first '{' and the last '}'
+    start = response.find('{')
+    end = response.rfind('}')
+
+    # Ensure both brackets are found
+    if start == -1 or end == -1 or start > end:
+        return None
+    return response[start:end + 1]
+
+
+def valid_quiz(response):
+    # A quiz is a non-empty object of question -> {'options': {A, B, C, D}, 'answer': one of them}
+    quiz_json = extract_json(response)
+    if quiz_json is None:
+        return False
+    try:
+        quiz = json.loads(quiz_json)
+    except ValueError:
+        return False
+    if not isinstance(quiz, dict) or not quiz:
+        return False
+    for details in quiz.values():
+        if not isinstance(details, dict) or not isinstance(details.get('options'), dict):
+            return False
+        if sorted(details['options']) != ['A', 'B', 'C', 'D'] or details.get('answer') not in details['options']:
+            return False
+    return True
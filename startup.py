@@ -0,0 +1,25 @@
+import threading
+import time
+
+started = time.perf_counter()
+last_mark = started
+timings = {}
+lock = threading.Lock()
+
+
+def mark(name):
+    # Records the time since the previous mark as the startup phase `name`
+    global last_mark
+    now = time.perf_counter()
+    with lock:
+        timings[name] = now - last_mark
+        last_mark = now
+
+
+def report():
+    with lock:
+        phases = dict(timings)
+    print(f'Startup took {time.perf_counter() - started:.3f}s')
+    for name, seconds in phases.items():
+        print(f'    {name}: {seconds * 1000:.1f}ms')
+    return phases
@@ -0,0 +1,77 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import bs4bible
+import lrucache
+
+
+class SearchPage(BaseHTTPRequestHandler):
+    # Stands in for the image search: every result names the query it was asked for
+    queries = []
+    delay = 0.0
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)['q'][0]
+        SearchPage.queries.append(query)
+        time.sleep(SearchPage.delay)
+        body = ''.join(f'<img class="mimg" src="https://images.test/{query.replace(" ", "-")}/{i}.jpg">' for i in range(3))
+        body += '<img class="other" src="https://images.test/ignored.jpg"><img class="mimg">'
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    SearchPage.queries = []
+    SearchPage.delay = 0.0
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), SearchPage)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(bs4bible, 'search_url', f'http://127.0.0.1:{httpd.server_address[1]}/images/search')
+    monkeypatch.setattr(bs4bible, 'image_cache', lrucache.LRUCache(max_entries=16))
+    monkeypatch.setattr(bs4bible, 'rate_limiter', bs4bible.TokenBucket(rate=100.0, capacity=100))
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_search_parses_and_caches_results(server):
+    expected = [f'https://images.test/jericho-bible/{i}.jpg' for i in range(3)]
+    assert bs4bible.search('Jericho') == expected
+    assert bs4bible.search('  jericho ') == expected
+    assert SearchPage.queries == ['jericho bible']
+
+
+def test_exhausted_rate_limit_fails_fast_or_serves_a_stale_result(server, monkeypatch):
+    assert bs4bible.search('Jericho') == [f'https://images.test/jericho-bible/{i}.jpg' for i in range(3)]
+    monkeypatch.setattr(bs4bible, 'cache_ttl', 0)
+    monkeypatch.setattr(bs4bible, 'rate_limiter', bs4bible.TokenBucket(rate=0.01, capacity=1))
+    assert bs4bible.search('Bethel') == [f'https://images.test/bethel-bible/{i}.jpg' for i in range(3)]
+
+    # The bucket is empty and the next token is 100 seconds away, well past max_rate_wait
+    start = time.monotonic()
+    assert bs4bible.search('Bethel') == [f'https://images.test/bethel-bible/{i}.jpg' for i in range(3)]
+    assert bs4bible.search('Jericho') == [f'https://images.test/jericho-bible/{i}.jpg' for i in range(3)]
+    assert bs4bible.search('Hebron') == []
+    assert time.monotonic() - start < 1
+    assert SearchPage.queries == ['jericho bible', 'bethel bible']
+
+
+def test_search_all_fetches_images_and_maps_concurrently(server):
+    SearchPage.delay = 0.3
+    start = time.monotonic()
+    images, maps = bs4bible.search_all('Jericho')
+    assert time.monotonic() - start < 0.55
+    assert images == [f'https://images.test/jericho-bible/{i}.jpg' for i in range(3)]
+    assert maps == [f'https://images.test/jericho-map-bible/{i}.jpg' for i in range(3)]
+    assert sorted(SearchPage.queries) == ['jericho bible', 'jericho map bible']
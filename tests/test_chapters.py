@@ -0,0 +1,23 @@
+import pytest
+
+import chapterstore
+import prompts
+
+verses = ('<span class="heading">The Beginning</span>', '1) In the beginning', '2) The earth', '3) Let there be light')
+
+
+def test_missing_chapter_without_pack(tmp_path):
+    store = chapterstore.ChapterStore(['nasb'], ['Genesis'], str(tmp_path))
+    with pytest.raises(chapterstore.ChapterNotFound):
+        store.get('Genesis', '999', 'nasb')
+
+
+def test_verse_range():
+    assert prompts.select_verses(verses, '2', '3') == ['2) The earth', '3) Let there be light']
+    assert prompts.select_verses(verses, 2) == ['2) The earth', '3) Let there be light']
+
+
+@pytest.mark.parametrize('start, end', [('abc', '3'), ('1', '2x'), ('0', '2'), ('-1', '2'), ('3', '1')])
+def test_bad_verse_range(start, end):
+    with pytest.raises(prompts.BadVerseRange):
+        prompts.select_verses(verses, start, end)
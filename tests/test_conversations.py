@@ -0,0 +1,42 @@
+import conversations
+
+
+def test_sessions_start_from_the_second_question():
+    store = conversations.SessionStore(max_context_tokens=100)
+    session = store.open('tab', ('m', 'nasb', 'Genesis', '1'), lambda: 'CHAPTER ')
+    built = []
+
+    def turn():
+        built.append(1)
+        return 'question'
+
+    # The first question on a chapter is answered standalone and never builds a turn
+    assert session.begin(turn) is None
+    assert built == []
+
+    assert session.begin(turn) == ('CHAPTER question', {})
+    store.finish(session, list(range(40)))
+    assert session.begin(turn) == ('question', {'context': list(range(40))})
+    store.finish(session, list(range(80)))
+
+
+def test_chapter_too_long_for_a_session_is_asked_standalone():
+    store = conversations.SessionStore(max_context_tokens=100)
+    session = store.open('tab', ('m', 'nasb', 'Psalms', '119'), lambda: 'CHAPTER ')
+    assert session.begin(lambda: 'question') is None
+    assert session.begin(lambda: 'question') == ('CHAPTER question', {})
+    # The chapter text alone overflows the cap, so starting over would never be reused
+    store.finish(session, list(range(150)))
+    assert session.begin(lambda: 'question') is None
+    assert session.begin(lambda: 'question') is None
+
+
+def test_overlong_conversation_starts_over_once():
+    store = conversations.SessionStore(max_context_tokens=100)
+    session = store.open('tab', ('m', 'nasb', 'John', '3'), lambda: 'CHAPTER ')
+    session.begin(lambda: 'q')
+    session.begin(lambda: 'q')
+    store.finish(session, list(range(60)))
+    session.begin(lambda: 'q')
+    store.finish(session, list(range(120)))
+    assert session.begin(lambda: 'q') == ('CHAPTER q', {})
@@ -0,0 +1,15 @@
+import dictionary
+
+
+def test_stored_miss_never_reaches_wordnet(monkeypatch):
+    monkeypatch.setattr(dictionary, 'table', {'forms': {'light': 'light.n.01', 'moses': None}, 'entries': {'light.n.01': ['electromagnetic radiation', ['light', 'visible light']]}})
+    calls = []
+    monkeypatch.setattr(dictionary, 'wordnet_synset', lambda word: calls.append(word))
+
+    assert dictionary.get_word_info('Moses') is None
+    assert dictionary.get_word_info('light') == ('electromagnetic radiation', ['light', 'visible light'])
+    assert calls == []
+
+    # Only words the corpus never contained fall back to WordNet
+    assert dictionary.get_word_info('quasar') is None
+    assert calls == ['quasar']
@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+import embedding
+import warmup
+
+
+class OfflineModel:
+    calls = []
+
+    @classmethod
+    def from_pretrained(cls, name, **kwargs):
+        cls.calls.append(kwargs)
+        raise OSError(f'{name} is not in the cache')
+
+
+def test_from_pretrained_never_falls_back_to_the_hub():
+    OfflineModel.calls = []
+    with pytest.raises(OSError, match='python embedding.py'):
+        embedding.from_pretrained(OfflineModel)
+    assert OfflineModel.calls == [{'local_files_only': True}]
+
+
+def test_missing_onnx_graph_fails_the_warm_up_instead_of_exporting(monkeypatch, tmp_path):
+    def export_onnx(*args):
+        raise AssertionError('the graph was exported while warming up')
+    monkeypatch.setattr(embedding, 'export_onnx', export_onnx)
+    monkeypatch.setattr(embedding, 'load_tokenizer', lambda: None)
+    monkeypatch.setattr(embedding, 'backend', 'onnx')
+    monkeypatch.setattr(embedding, 'onnx_paths', {'onnx': str(tmp_path / 'embedding.onnx')})
+    monkeypatch.setattr(embedding, 'model', None)
+
+    warmer = warmup.WarmupManager(retry_interval=60)
+    warmer.add('embedding', embedding.get_embedding, 'warm up', 'query')
+    warmer.start()
+    deadline = time.monotonic() + 5
+    while warmer.status()['embedding']['status'] != 'failed' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    status = warmer.status()['embedding']
+    assert not warmer.ready()
+    assert status['status'] == 'failed'
+    assert 'python embedding.py --onnx' in status['error']
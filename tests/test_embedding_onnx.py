@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import embedding
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+pytest.importorskip('onnxruntime')
+pytest.importorskip('onnxscript')
+
+
+def tiny_bert():
+    config = transformers.BertConfig(vocab_size=100, hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64)
+    torch.manual_seed(0)
+    return transformers.BertModel(config).eval()
+
+
+def tokenize(texts, return_tensors='pt', **kwargs):
+    # Same key order as the Hugging Face tokenizer (input_ids, token_type_ids, attention_mask), with padding
+    lengths = [len(text.split()) + 2 for text in texts]
+    width = max(lengths)
+    ids = np.zeros((len(texts), width), dtype=np.int64)
+    mask = np.zeros((len(texts), width), dtype=np.int64)
+    for row, length in enumerate(lengths):
+        ids[row, :length] = np.arange(1, length + 1) * 7 % 100
+        mask[row, :length] = 1
+    inp = {'input_ids': ids, 'token_type_ids': np.zeros_like(ids), 'attention_mask': mask}
+    return {name: torch.from_numpy(value) for name, value in inp.items()} if return_tensors == 'pt' else inp
+
+
+def test_onnx_export_matches_torch_with_padding(monkeypatch, tmp_path):
+    model = tiny_bert()
+    monkeypatch.setattr(embedding, 'load_torch_model', lambda: model)
+    monkeypatch.setattr(embedding, 'load_tokenizer', lambda: tokenize)
+    path = str(tmp_path / 'embedding.onnx')
+    embedding.export_onnx(path, str(tmp_path / 'embedding.int8.onnx'))
+
+    texts = ['in the beginning', 'a much longer verse with many more words in it']
+    session = embedding.load_onnx_session(path)
+    monkeypatch.setattr(embedding, 'load_model', lambda: (session, tokenize))
+    with torch.no_grad():
+        expected = model(**tokenize(texts)).last_hidden_state
+    mask = tokenize(texts)['attention_mask'].unsqueeze(2)
+    for mode, reference in (('sentence', expected[:, 0, :]), ('query', (expected * mask).sum(dim=1) / mask.sum(dim=1))):
+        vectors = embedding.embed_tokens_onnx(tokenize(texts, return_tensors='np'), mode)
+        assert np.allclose(vectors, reference.numpy(), atol=1e-4)
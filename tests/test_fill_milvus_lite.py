@@ -0,0 +1,43 @@
+import threading
+
+import numpy as np
+
+import fill_milvus_lite
+
+
+class EmptyClient:
+    def list_collections(self):
+        return []
+
+    def close(self):
+        pass
+
+
+def test_failed_collection_create_stops_the_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    verses = [(fill_milvus_lite.row_id('nasb', 1001001 + i), 'nasb', 1001001 + i, f'Genesis 1:{i + 1}', f'verse {i}') for i in range(64 * 12)]
+    monkeypatch.setattr(fill_milvus_lite, 'versions', ['nasb'])
+    monkeypatch.setattr(fill_milvus_lite, 'iter_verses', lambda versions: iter(verses))
+    monkeypatch.setattr(fill_milvus_lite.milvuslitebible, 'open_client', lambda path: EmptyClient())
+    monkeypatch.setattr(fill_milvus_lite.embedding, 'token_lengths', lambda texts: [len(text) for text in texts])
+    monkeypatch.setattr(fill_milvus_lite.embedding, 'tokenize', lambda texts: len(texts))
+    monkeypatch.setattr(fill_milvus_lite.embedding, 'embed_tokens', lambda count, mode: np.zeros((count, 8), dtype=np.float32))
+
+    def create_collection(**kwargs):
+        raise RuntimeError('cannot create the collection')
+    monkeypatch.setattr(fill_milvus_lite.milvuslitebible, 'create_collection', create_collection)
+
+    # More batches than the queues hold, so a dead inserter would block the embedding loop forever
+    thread = threading.Thread(target=fill_milvus_lite.run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+
+
+def test_fp16_is_rejected_before_opening_milvus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(fill_milvus_lite, 'compression', 'normalize+fp16')
+    opened = []
+    monkeypatch.setattr(fill_milvus_lite.milvuslitebible, 'open_client', lambda path: opened.append(path))
+    fill_milvus_lite.run()
+    assert opened == []
@@ -0,0 +1,44 @@
+import lexicalindex
+
+
+class Retriever:
+    def __init__(self):
+        self.queries = []
+
+    def search(self, query, k=5, version=None):
+        self.queries.append(query)
+        return [{'title': 'Vector 1:1', 'text': 'found by meaning', 'score': 0.0}]
+
+
+def build(tmp_path):
+    verses = [(f'Genesis 1:{i + 1}', f'and love was with them in the field number {i}') for i in range(40)]
+    verses.append(('Psalms 119:1', 'love love love the law of love'))
+    verses += [('Genesis 14:18', 'Melchizedek king of Salem'), ('Hebrews 7:1', 'For this Melchizedek king of Salem')]
+    prefix = str(tmp_path / 'test.lexical')
+    lexicalindex.build_index(prefix, verses)
+    return lexicalindex.LexicalIndex(prefix)
+
+
+def test_phrase_hits_are_ranked_by_bm25(tmp_path):
+    index = build(tmp_path)
+    hits, matches = index.phrase('love', k=5)
+    assert matches == 41
+    assert hits[0]['title'] == 'Psalms 119:1'
+
+
+def test_selective_query_skips_the_vector_search(tmp_path):
+    index = build(tmp_path)
+    retriever = Retriever()
+    hits = lexicalindex.hybrid_search(index, retriever, 'Melchizedek', k=5)
+    assert [hit['title'] for hit in hits] == ['Genesis 14:18', 'Hebrews 7:1']
+    assert retriever.queries == []
+
+
+def test_common_word_is_fused_with_the_vector_search(tmp_path):
+    index = build(tmp_path)
+    retriever = Retriever()
+    hits = lexicalindex.hybrid_search(index, retriever, 'love', k=5)
+    assert retriever.queries == ['love']
+    titles = [hit['title'] for hit in hits]
+    assert titles[0] == 'Psalms 119:1'
+    assert 'Vector 1:1' in titles
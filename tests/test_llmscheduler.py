@@ -0,0 +1,125 @@
+import threading
+import time
+
+import llmscheduler
+
+
+def fake_generate(calls, tokens=5, delay=0.01, closed=None):
+    def generate(model, prompt, keep_alive, stream=False, **options):
+        calls.append(prompt)
+
+        def chunks():
+            try:
+                for i in range(tokens):
+                    time.sleep(delay)
+                    yield {'response': f'{prompt}-{i}', 'done': False}
+                yield {'response': '', 'done': True}
+            finally:
+                if closed is not None:
+                    closed.set()
+        return chunks()
+    return generate
+
+
+def collect(stream):
+    return [chunk['response'] for chunk in stream if chunk['response']]
+
+
+def test_identical_streams_share_one_generation(monkeypatch):
+    calls = []
+    monkeypatch.setattr(llmscheduler.ollama, 'generate', fake_generate(calls, delay=0.02))
+    scheduler = llmscheduler.GenerationScheduler(concurrency={'m': 2}, max_queue_depth=16)
+    prompts = ['a', 'b', 'c']
+    results = {}
+    errors = []
+
+    def reader(i):
+        prompt = prompts[i % len(prompts)]
+        try:
+            results[i] = (prompt, collect(scheduler.stream('m', prompt)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(60)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(calls) == prompts
+    for prompt, tokens in results.values():
+        assert tokens == [f'{prompt}-{i}' for i in range(5)]
+    stats = scheduler.stats()['m']
+    assert stats['coalesced'] == 57
+    assert stats['rejected'] == 0
+    assert stats['active'] == 0
+
+
+def test_late_subscriber_replays_earlier_chunks(monkeypatch):
+    calls = []
+    monkeypatch.setattr(llmscheduler.ollama, 'generate', fake_generate(calls, delay=0.02))
+    scheduler = llmscheduler.GenerationScheduler(concurrency={'m': 1})
+    first = iter(scheduler.stream('m', 'p'))
+    assert next(first)['response'] == 'p-0'
+    assert next(first)['response'] == 'p-1'
+
+    late = scheduler.stream('m', 'p')
+    assert collect(late) == [f'p-{i}' for i in range(5)]
+    assert [chunk['response'] for chunk in first if chunk['response']] == [f'p-{i}' for i in range(2, 5)]
+    assert calls == ['p']
+
+
+def test_closing_every_subscriber_aborts_the_generation(monkeypatch):
+    calls = []
+    closed = threading.Event()
+    monkeypatch.setattr(llmscheduler.ollama, 'generate', fake_generate(calls, tokens=1000, closed=closed))
+    scheduler = llmscheduler.GenerationScheduler(concurrency={'m': 1})
+    one = scheduler.stream('m', 'p')
+    two = scheduler.stream('m', 'p')
+    next(iter(one))
+    one.close()
+    assert not closed.wait(0.1)
+    two.close()
+    assert closed.wait(2)
+
+    # The slot is free again and a new request starts a new generation
+    again = scheduler.stream('m', 'q')
+    assert next(iter(again))['response'] == 'q-0'
+    again.close()
+    assert calls == ['p', 'q']
+
+
+def test_model_options_are_sent_with_every_request(monkeypatch):
+    sent = []
+
+    def generate(model, prompt, keep_alive, stream=False, **options):
+        sent.append(options)
+        if stream:
+            return (chunk for chunk in [{'response': 'x', 'done': False}, {'response': '', 'done': True}])
+        return {'response': 'x'}
+    monkeypatch.setattr(llmscheduler.ollama, 'generate', generate)
+    scheduler = llmscheduler.GenerationScheduler(model_options={'m': {'num_ctx': 4096}})
+
+    scheduler.generate('m', 'a')
+    collect(scheduler.stream('m', 'b', context=[1, 2]))
+    scheduler.generate('other', 'c')
+    assert sent == [{'options': {'num_ctx': 4096}}, {'context': [1, 2], 'options': {'num_ctx': 4096}}, {}]
+
+
+def test_streamed_generation_is_recorded_under_the_request_route(monkeypatch):
+    observed = []
+
+    def generate(model, prompt, keep_alive, stream=False, **options):
+        return (chunk for chunk in [{'response': 'x', 'done': False}, {'response': '', 'done': True, 'prompt_eval_duration': 10 ** 7, 'eval_duration': 10 ** 8}])
+    monkeypatch.setattr(llmscheduler.ollama, 'generate', generate)
+    monkeypatch.setattr(llmscheduler.metrics, 'observe', lambda stage, seconds: observed.append((stage, llmscheduler.metrics.route())))
+    scheduler = llmscheduler.GenerationScheduler()
+
+    llmscheduler.metrics.current.route = 'explain_selection_stream'
+    try:
+        collect(scheduler.stream('m', 'a'))
+    finally:
+        llmscheduler.metrics.current.route = None
+    assert ('prefill', 'explain_selection_stream') in observed
+    assert ('generation', 'explain_selection_stream') in observed
@@ -0,0 +1,49 @@
+import numpy as np
+
+import numpyindex
+
+
+class PagedClient:
+    # Minimal MilvusClient: query_iterator pages, and a row_count that still counts replaced rows
+    def __init__(self, rows, page_size):
+        self.rows = rows
+        self.page_size = page_size
+        self.pages_read = 0
+
+    def load_collection(self, collection_name):
+        pass
+
+    def get_collection_stats(self, collection_name):
+        return {'row_count': len(self.rows) * 3}
+
+    def query_iterator(self, collection_name, batch_size, filter, output_fields):
+        client = self
+        pages = [self.rows[i:i + batch_size] for i in range(0, len(self.rows), batch_size)]
+
+        class Iterator:
+            def next(self):
+                client.pages_read += 1
+                return pages.pop(0) if pages else []
+
+            def close(self):
+                pass
+        return Iterator()
+
+
+def test_export_stops_at_the_last_live_row(tmp_path):
+    # Ids as fill_milvus_lite.py writes them: version number * 100000000 + BBCCCVVV
+    rows = []
+    for number, version in enumerate(['kjv', 'nasb'], start=1):
+        for verse in range(1, 6):
+            verse_id = 1001000 + verse
+            rows.append({'id': number * 100000000 + verse_id, 'vector': [float(verse), 0.0], 'title': f'Genesis 1:{verse}', 'text': f'{version} {verse}', 'version': version})
+    client = PagedClient(rows[::-1], page_size=4)
+    prefix = str(tmp_path / 'bible')
+    numpyindex.export_from_milvus(client, 'bible', prefix, page_size=4)
+
+    assert client.pages_read == 4
+    retriever = numpyindex.NumpyRetriever(prefix)
+    retriever.connect()
+    assert retriever.ranges == {'kjv': [0, 5], 'nasb': [5, 10]}
+    hits = retriever.search_vectors(np.array([[3.0, 0.0]]), k=1, partition='nasb')[0]
+    assert hits[0]['text'] == 'nasb 3'
@@ -0,0 +1,97 @@
+import numpy as np
+import os
+
+# Compression applied to verse vectors before they are stored, e.g. "normalize+fp16+pca192".
+# "normalize" stores unit vectors searched by inner product, "fp16" halves the storage,
+# "pcaN" projects onto the top N principal components of the corpus. "none" keeps fp32 L2.
+default_mode = os.environ.get('VECTOR_COMPRESSION', 'none')
+
+
+def codec_path(prefix):
+    return f'{prefix}.codec.npz'
+
+
+class VectorCodec:
+    # The same transform has to be applied to verse vectors at indexing time and to query vectors at search time
+    def __init__(self, normalize=False, dtype='float32', dimensions=None, mean=None, components=None):
+        self.normalize = normalize
+        self.dtype = np.dtype(dtype)
+        self.dimensions = dimensions
+        self.mean = mean
+        self.components = components
+
+    @classmethod
+    def from_mode(cls, mode=default_mode):
+        normalize = False
+        dtype = 'float32'
+        dimensions = None
+        for part in mode.lower().split('+'):
+            if part in ('', 'none', 'fp32'):
+                continue
+            elif part == 'normalize':
+                normalize = True
+            elif part == 'fp16':
+                dtype = 'float16'
+            elif part.startswith('pca') and part[3:].isdigit():
+                dimensions = int(part[3:])
+            else:
+                raise ValueError(f'Unknown vector compression {part!r} in {mode!r}')
+        return cls(normalize, dtype, dimensions)
+
+    @property
+    def mode(self):
+        parts = []
+        if self.normalize:
+            parts.append('normalize')
+        if self.dtype == np.float16:
+            parts.append('fp16')
+        if self.dimensions:
+            parts.append(f'pca{self.dimensions}')
+        return '+'.join(parts) or 'none'
+
+    @property
+    def metric(self):
+        return 'IP' if self.normalize else 'L2'
+
+    @property
+    def needs_fit(self):
+        return self.dimensions is not None and self.components is None
+
+    def fit(self, sample):
+        # Principal components of a sample of verse vectors; a few thousand verses are plenty for 384 dimensions
+        sample = np.asarray(sample, dtype=np.float32)
+        self.mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:self.dimensions])
+        return self
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.components is not None:
+            vectors = (vectors - self.mean) @ self.components.T
+        if self.normalize:
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return np.ascontiguousarray(vectors, dtype=self.dtype)
+
+    def output_dimensions(self, input_dimensions):
+        return self.dimensions or input_dimensions
+
+    def save(self, prefix):
+        arrays = {'mode': np.array(self.mode)}
+        if self.components is not None:
+            arrays['mean'] = self.mean
+            arrays['components'] = self.components
+        np.savez(codec_path(prefix), **arrays)
+
+    @classmethod
+    def load(cls, prefix):
+        # None when the index was built without a codec, i.e. plain fp32 L2
+        path = codec_path(prefix)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            codec = cls.from_mode(str(arrays['mode']))
+            if 'components' in arrays:
+                codec.mean = arrays['mean']
+                codec.components = arrays['components']
+        return codec
@@ -0,0 +1,202 @@
+import argparse
+import embedding
+import metrics
+import milvuslitebible
+import numpyindex
+import os
+import signal
+import sys
+import threading
+import warmup
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# Unix socket of the process that owns the embedding model and the vector index; empty keeps both inside the web process
+address = os.environ.get('VECTOR_SERVICE', '')
+# Shared secret checked on every new connection. The service unpickles what it receives, so there is no default:
+# gunicorn.conf.py generates one per start and passes it to the service and the workers.
+authkey = os.environ.get('VECTOR_SERVICE_KEY', '').encode('utf-8')
+# Seconds a web worker waits for an answer before giving up on the service
+timeout = 30.0
+
+
+class VectorServiceError(RuntimeError):
+    pass
+
+
+def require_authkey(authkey):
+    if not authkey:
+        raise VectorServiceError('VECTOR_SERVICE_KEY must be set to the secret shared by the vector service and the web workers')
+    return authkey
+
+
+def local_retriever(database_name, collection_name):
+    # VECTOR_INDEX=numpy searches the memory-mapped export written by `python numpyindex.py` instead of Milvus Lite
+    if os.environ.get('VECTOR_INDEX', 'milvus') == 'numpy':
+        return numpyindex.get_retriever(collection_name, metric='L2')
+    return milvuslitebible.get_retriever(database_name, collection_name, metric='L2')
+
+
+class VectorService:
+    # One copy of the model, the index and the search cache for every web worker on the host.
+    # Each connection gets a thread, so concurrent queries from all workers share the embedding batcher.
+    def __init__(self, retriever, address, authkey=authkey):
+        self.retriever = retriever
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self.listener = None
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.warmer = warmup.WarmupManager()
+        self.warmer.add('embedding', embedding.get_embedding, 'warm up', 'query')
+        self.warmer.add('vector index', retriever.connect)
+
+    def handle(self, method, args):
+        if method == 'search_many':
+            return self.retriever.search_many(*args)
+        if method == 'embed':
+            return embedding.get_cached_embeddings(*args)
+        if method == 'status':
+            return self.status()
+        raise ValueError(f'Unknown method {method!r}')
+
+    def status(self):
+        with self.lock:
+            connections = self.connections
+        return {
+            'pid': os.getpid(),
+            'ready': self.warmer.ready(),
+            'components': self.warmer.status(),
+            'connections': connections,
+            'metric': self.retriever.metric,
+            'partitions': sorted(self.retriever.partitions),
+            'results_cache': milvuslitebible.results_cache.stats(),
+        }
+
+    def serve(self, connection):
+        with self.lock:
+            self.connections += 1
+        try:
+            while True:
+                try:
+                    method, args = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ('ok', self.handle(method, args))
+                except Exception as e:
+                    reply = ('error', f'{type(e).__name__}: {e}')
+                connection.send(reply)
+        finally:
+            connection.close()
+            with self.lock:
+                self.connections -= 1
+
+    def reload(self):
+        # SIGHUP reopens the index, e.g. after it was rebuilt, without dropping worker connections
+        print(f'Reloading {self.retriever.collection_name}.')
+        milvuslitebible.results_cache.clear()
+        self.retriever.close()
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            # Left behind by a service that was killed
+            os.remove(self.address)
+        self.listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        self.warmer.start()
+        print(f'Vector service listening on {self.address}')
+        try:
+            while True:
+                try:
+                    connection = self.listener.accept()
+                except AuthenticationError as e:
+                    print(f'Rejected a connection: {e}')
+                    continue
+                threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+        finally:
+            self.listener.close()
+            if os.path.exists(self.address):
+                os.remove(self.address)
+
+
+class RemoteRetriever:
+    # Same search interface as milvuslitebible.BibleRetriever, answered by the vector service
+    def __init__(self, address=address, authkey=authkey):
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self.collection_name = f'service:{address}'
+        self.metric = None
+        self.partitions = set()
+        self.local = threading.local()
+
+    def exchange(self, connection, method, args):
+        connection.send((method, args))
+        if not connection.poll(timeout):
+            # The late answer would be read by the next call, so this connection cannot be reused
+            self.close()
+            raise VectorServiceError(f'Vector service at {self.address} did not answer {method} within {timeout}s')
+        status, result = connection.recv()
+        if status == 'error':
+            raise VectorServiceError(result)
+        return result
+
+    def call(self, method, *args):
+        # One connection per thread; a connection broken by a service restart is reopened once
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            try:
+                return self.exchange(connection, method, args)
+            except (EOFError, OSError):
+                self.close()
+        try:
+            connection = self.local.connection = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            return self.exchange(connection, method, args)
+        except (EOFError, OSError, AuthenticationError) as e:
+            self.close()
+            raise VectorServiceError(f'Vector service at {self.address} is unavailable: {e}') from e
+
+    def connect(self):
+        # Used as the warm-up target, so it fails until the service has loaded the model and the index
+        status = self.call('status')
+        if not status['ready']:
+            raise VectorServiceError(f'Vector service at {self.address} is still warming up')
+        self.metric = status['metric']
+        self.partitions = set(status['partitions'])
+        return self
+
+    def search(self, query, k=5, version=None):
+        return self.search_many([query], k, version)[0]
+
+    def search_many(self, queries, k=5, version=None):
+        with metrics.span('vector_service'):
+            return self.call('search_many', list(queries), k, version)
+
+    def embed(self, texts, mode='query'):
+        return self.call('embed', list(texts), mode)
+
+    def stats(self):
+        return self.call('status')
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve embedding and vector search to the web workers over a Unix socket.')
+    parser.add_argument('--address', default=address or 'vectorservice.sock')
+    parser.add_argument('--database', default='milvuslitebible')
+    parser.add_argument('--collection', default='milvuslitebible_bible')
+    args = parser.parse_args()
+    if not authkey:
+        # Checked before the model and the index are loaded
+        parser.error('VECTOR_SERVICE_KEY must be set')
+
+    service = VectorService(local_retriever(args.database, args.collection), args.address)
+    signal.signal(signal.SIGHUP, lambda signum, frame: service.reload())
+    # TERM from the WSGI master ends serve_forever, which removes the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    service.serve_forever()
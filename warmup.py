@@ -0,0 +1,52 @@
+import threading
+import time
+
+
+class WarmupManager:
+    # Warms every component concurrently and tracks what is ready so /readyz can gate traffic
+    def __init__(self, retry_interval=5.0):
+        self.retry_interval = retry_interval
+        self.components = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, target, *args):
+        with self.lock:
+            self.components[name] = {'target': target, 'args': args, 'status': 'pending', 'attempts': 0, 'duration': None, 'error': None}
+
+    def start(self):
+        with self.lock:
+            names = list(self.components)
+        for name in names:
+            threading.Thread(target=self.run, args=(name,), name=f'warmup-{name}', daemon=True).start()
+
+    def run(self, name):
+        component = self.components[name]
+        while True:
+            with self.lock:
+                component['status'] = 'warming'
+                component['attempts'] += 1
+            start = time.perf_counter()
+            try:
+                component['target'](*component['args'])
+            except Exception as e:
+                # Keep retrying so an instance recovers once Ollama or the index becomes available
+                print(f'Warm-up of {name} failed: {e}')
+                with self.lock:
+                    component['status'] = 'failed'
+                    component['error'] = str(e)
+                time.sleep(self.retry_interval)
+                continue
+            with self.lock:
+                component['status'] = 'ready'
+                component['duration'] = time.perf_counter() - start
+                component['error'] = None
+            print(f'Warmed {name} in {component["duration"]:.3f}s')
+            return
+
+    def ready(self):
+        with self.lock:
+            return all(component['status'] == 'ready' for component in self.components.values())
+
+    def status(self):
+        with self.lock:
+            return {name: {key: value for key, value in component.items() if key not in ('target', 'args')} for name, component in self.components.items()}